@@ -0,0 +1,518 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bondsAnalytics import DAYS_IN_YEAR, cashflow_matrix, discounted_metrics, scenario_prices, ytm_scalar
+
+
+# ---- Синтетические облигации для замеров ----
+def synthetic_cashflows(n: int, seed: int = 0):
+    """Плоские купоны и цены для n облигаций: 1-12 купонов в год, погашение от месяца до 15 лет."""
+    rng = np.random.default_rng(seed)
+    per_year = rng.choice([1, 2, 4, 12], size=n)
+    maturity_days = rng.integers(30, 365 * 15, size=n)
+    nominal = rng.choice([1000.0, 500.0, 100.0], size=n)
+    coupon = nominal * rng.uniform(0.0, 0.2, size=n) / per_year
+
+    counts = np.maximum(1, (maturity_days * per_year) // 365)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    step = 365 // np.repeat(per_year, counts)
+    position = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+    coupon_days = np.repeat(maturity_days, counts) - position * step
+    coupon_values = np.repeat(coupon, counts)
+
+    price = nominal * rng.uniform(0.6, 1.2, size=n)
+    return price, nominal, maturity_days, coupon_values, coupon_days, offsets
+
+
+def bench_ytm(n: int, seed: int):
+    price, nominal, maturity_days, coupon_values, coupon_days, offsets = synthetic_cashflows(n, seed)
+
+    started = time.perf_counter()
+    cashflows, times = cashflow_matrix(nominal, maturity_days, coupon_values, coupon_days, offsets)
+    vector = discounted_metrics(price, cashflows, times)["irr"]
+    vector_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scalar = np.array([
+        ytm_scalar(price[i],
+                   list(coupon_values[offsets[i]:offsets[i + 1]]) + [nominal[i]],
+                   list(coupon_days[offsets[i]:offsets[i + 1]] / DAYS_IN_YEAR) + [maturity_days[i] / DAYS_IN_YEAR])
+        for i in range(n)
+    ])
+    scalar_time = time.perf_counter() - started
+
+    both = ~np.isnan(vector) & ~np.isnan(scalar)
+    print(f"bonds: {n}, coupons: {offsets[-1]}")
+    print(f"vectorized: {vector_time:.3f} s ({n / vector_time:,.0f} bonds/s)")
+    print(f"scalar:     {scalar_time:.3f} s ({n / scalar_time:,.0f} bonds/s)")
+    print(f"speedup:    {scalar_time / vector_time:.1f}x")
+    print(f"solved:     {both.sum()} of {n}, NaN mismatches: {(np.isnan(vector) != np.isnan(scalar)).sum()}")
+    print(f"max |diff|: {np.abs(vector[both] - scalar[both]).max() if both.any() else 0.0:.2e}")
+
+
+def synthetic_scenarios(count: int):
+    """count кривых сдвига: параллельные ±100..±300 б.п. и наклоны вокруг 1-10 лет, по кругу с ростом шага."""
+    curves = []
+    while len(curves) < count:
+        step = 100 * (len(curves) // 8 + 1)
+        for bp in (step, 2 * step, 3 * step):
+            curves += [[[0, bp]], [[0, -bp]]]
+        curves += [[[1, -step / 2], [10, step / 2]], [[1, step / 2], [10, -step / 2]]]
+    return curves[:count]
+
+
+def bench_scenarios(n: int, count: int, seed: int):
+    price, nominal, maturity_days, coupon_values, coupon_days, offsets = synthetic_cashflows(n, seed)
+    cashflows, times = cashflow_matrix(nominal, maturity_days, coupon_values, coupon_days, offsets)
+    y = discounted_metrics(price, cashflows, times)["irr"]
+    curves = synthetic_scenarios(count)
+
+    started = time.perf_counter()
+    prices = scenario_prices(cashflows, times, y, curves)
+    vector_time = time.perf_counter() - started
+
+    # эталон: те же сценарии по одной облигации, на первых 200 облигациях
+    sample = min(n, 200)
+    started = time.perf_counter()
+    scalar = np.array([[sum(cf * (1 + y[i] + np.interp(t, *np.array(curve, dtype=float).T) / 10_000) ** -t
+                            for cf, t in zip(cashflows[i], times[i]) if cf)
+                        for i in range(sample)] for curve in curves])
+    scalar_time = (time.perf_counter() - started) * n / sample
+
+    base = scenario_prices(cashflows, times, y, [[[0, 0]]])[0]
+    solved = ~np.isnan(y)
+    print(f"bonds: {n}, scenarios: {count}, cashflows: {np.count_nonzero(cashflows)}")
+    print(f"vectorized: {vector_time:.3f} s ({n * count / vector_time:,.0f} bond-scenarios/s)")
+    print(f"scalar:     {scalar_time:.3f} s (extrapolated from {sample} bonds)")
+    print(f"max |diff| vs scalar: {np.nanmax(np.abs(prices[:, :sample] - scalar)):.2e}")
+    print(f"zero shift vs price:  {np.abs(base[solved] / price[solved] - 1).max():.2e}")
+
+
+def _timed_runs(command, runs: int):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+# то, что не должно выполняться при импорте bondsList: ленивые модули остаются заглушками до первого обращения
+STARTUP_HEAVY_MODULES = ("numpy", "pandas", "requests", "asyncio", "tinkoff", "grpc", "tqdm", "pyarrow",
+                         "bondsAnalytics", "concurrent.futures.process")
+
+
+def startup_loaded_modules():
+    """Какие из STARTUP_HEAVY_MODULES на самом деле загружены сразу после import bondsList."""
+    code = ("import sys, bondsList\n"
+            f"for name in {STARTUP_HEAVY_MODULES!r}:\n"
+            "    module = sys.modules.get(name)\n"
+            "    if module is not None and type(module).__name__ != '_LazyModule':\n"
+            "        print(name)\n")
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def bench_startup(runs: int, max_ms=None):
+    """Запуск bondsList.py --version/--help отдельным процессом; «python -c pass» — старт самого интерпретатора.
+    С max_ms — проверка: код выхода 1, если медиана --version дольше max_ms или при импорте грузятся тяжёлые модули."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bondsList.py")
+    medians = {}
+    for name, command in (("python -c pass", [sys.executable, "-c", "pass"]),
+                          ("--version", [sys.executable, script, "--version"]),
+                          ("--help", [sys.executable, script, "--help"])):
+        times = _timed_runs(command, runs)
+        medians[name] = statistics.median(times) * 1000
+        print(f"{name:15} min {min(times) * 1000:6.1f} ms, median {medians[name]:6.1f} ms")
+    loaded = startup_loaded_modules()
+    print(f"loaded at import: {', '.join(loaded) or '-'}")
+
+    if max_ms is not None:
+        failures = []
+        if loaded:
+            failures.append(f"modules loaded at import: {', '.join(loaded)}")
+        if medians["--version"] > max_ms:
+            failures.append(f"--version median {medians['--version']:.1f} ms > {max_ms:.0f} ms")
+        if failures:
+            print("FAIL: " + "; ".join(failures))
+            sys.exit(1)
+        print("OK")
+
+
+# ---- Полный сбор collect_bonds() на подставных источниках (benchStubs) ----
+def _peak_rss_mb() -> float:
+    """Пиковый размер процесса в памяти, МБ."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: PeakWorkingSetSize из GetProcessMemoryInfo
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _latency_summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "calls": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def _time_stages(bl, timings):
+    """Подменяет стадии bondsList обёртками, которые пишут длительность каждого вызова в timings[стадия].
+
+    В конвейере и async-режиме сюда входит и ожидание ограничителя/семафора — это задержка,
+    которую видит облигация на стадии.
+    """
+    def timed(stage, fn):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings.setdefault(stage, []).append(time.perf_counter() - started)
+        return wrapper
+
+    def timed_async(stage, fn):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timings.setdefault(stage, []).append(time.perf_counter() - started)
+        return wrapper
+
+    bl.fetch_coupons = timed("coupons", bl.fetch_coupons)
+    bl.fetch_coupons_async = timed_async("coupons", bl.fetch_coupons_async)
+    bl.resolve_issuer = timed("itn", bl.resolve_issuer)
+    bl.lookup_ratings = timed("ratings", bl.lookup_ratings)
+    bl.compute_columns = timed("compute", bl.compute_columns)
+    for engine, collect in list(bl.ENGINES.items()):
+        bl.ENGINES[engine] = timed("engine", collect)
+
+
+def _histogram_sums(bl, name, label):
+    """Сумма секунд гистограммы метрик по значениям метки (например, по upstream)."""
+    sums = {}
+    for (metric, labels), hist in list(bl.METRICS.histograms.items()):
+        if metric == name:
+            key = dict(labels).get(label, "")
+            sums[key] = sums.get(key, 0.0) + hist[-2]
+    return sums
+
+
+def _seconds_since(before, after):
+    return {key: round(value - before.get(key, 0.0), 3) for key, value in after.items()
+            if value - before.get(key, 0.0) > 0}
+
+
+def _forget_memoized(bl):
+    """То, что в новом процессе было бы пустым: lru_cache и индексы рейтингов в памяти (файлы остаются)."""
+    for fn in (bl.get_company_itn, bl.get_acra_rating_by_isin, bl.get_NRA_rating_by_itn, bl.get_NKR_rating_by_itn):
+        fn.cache_clear()
+    bl._ACRA_INDEX = None
+    bl._RATING_INDEXES.clear()
+
+
+def bench_collect(n, engine, seed, latency, jitter, error_rate, http_latency, api_delay, rate_limits, repeat,
+                  quota=None, parse_workers=None, screen=None):
+    import benchStubs
+    import bondsList as bl
+
+    universe = benchStubs.SyntheticUniverse(n, seed)
+    api = benchStubs.FakeApi(universe, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed,
+                             quota=quota)
+    sites = benchStubs.RatingSites(universe, latency=http_latency, seed=seed).start()
+    universe_rss = _peak_rss_mb()
+
+    bl.TOKEN = "bench"
+    bl.API_DELAY = api_delay
+    bl.FOR_QUAL_INVESTOR = False
+    bl.AMORTIZATION = False
+    bl.FLOATING_COUPON = False
+    bl.RATE_LIMITS = {**{name: 0 for name in bl.RATE_LIMITS}, **rate_limits}
+    if parse_workers is not None:
+        bl.PARSE_WORKERS = parse_workers
+    bl.SCREEN = {**{name: 0 for name in bl.SCREEN}, **(screen or {})}
+    for name, url in sites.urls().items():
+        setattr(bl, name, url)
+    bl._CLIENT = benchStubs.FakeClient(api)
+    bl.async_client = lambda: benchStubs.FakeAsyncClient(api)
+    timings = {}
+    _time_stages(bl, timings)
+
+    runs = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        # кэш, выгрузки рейтингов и индексы — с нуля во временном каталоге; повторы видят кэш первого прохода
+        os.chdir(workdir)
+        try:
+            for _ in range(repeat):
+                _forget_memoized(bl)
+                timings.clear()
+                api.stats.clear()
+                sites.requests.clear()
+
+                network_before = _histogram_sums(bl, "bonds_upstream_latency_seconds", "upstream")
+                parse_before = _histogram_sums(bl, "bonds_parse_seconds", "parser")
+                started = time.perf_counter()
+                table = bl.collect_bonds(engine)
+                columns = bl.compute_columns(bl.screen_table(table))
+                seconds = time.perf_counter() - started
+
+                runs.append({
+                    "seconds": round(seconds, 3),
+                    "bonds_per_sec": round(len(table) / seconds, 1),
+                    "selected": len(table),
+                    "rows": len(columns["Имя"]),
+                    "stages": {stage: _latency_summary(values) for stage, values in timings.items()},
+                    "api": {method: {"calls": calls, "errors": errors, "latency_s": round(total, 3)}
+                            for method, (calls, errors, total) in api.stats.items()},
+                    "http": dict(sites.requests),
+                    # суммарное время по всем потокам: сеть по источникам и разбор ответов по парсерам
+                    "network_s": _seconds_since(network_before,
+                                                _histogram_sums(bl, "bonds_upstream_latency_seconds", "upstream")),
+                    "parse_s": _seconds_since(parse_before, _histogram_sums(bl, "bonds_parse_seconds", "parser")),
+                })
+        finally:
+            os.chdir(cwd)
+            bl.close_http_sessions()
+            bl.close_parse_pool()
+            if bl._CACHE_CONN is not None:
+                bl._CACHE_CONN.close()
+                bl._CACHE_CONN = None
+            sites.stop()
+
+    return {
+        "bonds": n,
+        "engine": engine,
+        "settings": {"seed": seed, "latency": latency, "jitter": jitter, "error_rate": error_rate,
+                     "http_latency": http_latency, "api_delay": api_delay, "rate_limits": rate_limits,
+                     "quota": quota, "parse_workers": bl.PARSE_WORKERS, "screen": screen or {}},
+        "runs": runs,
+        "universe_rss_mb": round(universe_rss, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def print_collect(result, baseline=None):
+    print(f"bonds: {result['bonds']}, engine: {result['engine']}, "
+          f"peak RSS: {result['peak_rss_mb']:.0f} MB (before collection: {result['universe_rss_mb']:.0f} MB)")
+    for number, run in enumerate(result["runs"], 1):
+        print(f"  run {number}: {run['seconds']:.2f} s, {run['bonds_per_sec']:,.0f} bonds/s, "
+              f"{run['selected']} selected, {run['rows']} rows")
+        print(f"    {'stage':10} {'calls':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for stage, s in run["stages"].items():
+            print(f"    {stage:10} {s['calls']:7} {s['mean_ms']:9.2f} {s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['max_ms']:9.2f}")
+        api = ", ".join(f"{m} {a['calls']} ({a['errors']} errors)" for m, a in run["api"].items())
+        http = ", ".join(f"{route} {count}" for route, count in sorted(run["http"].items()))
+        print(f"    api: {api or '-'}; http: {http or '-'}")
+        network = ", ".join(f"{source} {seconds:.2f}" for source, seconds in run.get("network_s", {}).items())
+        parse = ", ".join(f"{parser} {seconds:.2f}" for parser, seconds in run.get("parse_s", {}).items())
+        print(f"    network s: {network or '-'}; parse s: {parse or '-'}")
+    if baseline:
+        base, last = baseline["runs"][-1], result["runs"][-1]
+        print(f"  vs baseline: bonds/s x{last['bonds_per_sec'] / base['bonds_per_sec']:.2f}, "
+              f"peak RSS x{result['peak_rss_mb'] / baseline['peak_rss_mb']:.2f}")
+
+
+def run_collect(args):
+    results = []
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {(r["bonds"], r["engine"]): r for r in json.load(f)}
+
+    for n in args.bonds:
+        if len(args.bonds) == 1:
+            result = bench_collect(n, args.engine, args.seed, args.latency, args.jitter, args.error_rate,
+                                   args.http_latency, args.api_delay, json.loads(args.rate_limits), args.repeat,
+                                   args.quota, args.parse_workers, json.loads(args.screen))
+        else:
+            # каждый размер — в отдельном процессе, чтобы пиковая память не тянулась от предыдущего
+            with tempfile.TemporaryDirectory() as tmp:
+                out = os.path.join(tmp, "result.json")
+                subprocess.run([sys.executable, os.path.abspath(__file__), "collect", "--bonds", str(n),
+                                "--engine", args.engine, "--seed", str(args.seed), "--latency", str(args.latency),
+                                "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+                                "--http-latency", str(args.http_latency), "--api-delay", str(args.api_delay),
+                                "--rate-limits", args.rate_limits, "--screen", args.screen,
+                                "--repeat", str(args.repeat),
+                                *(["--quota", str(args.quota)] if args.quota else []),
+                                *(["--parse-workers", str(args.parse_workers)] if args.parse_workers is not None else []),
+                                "--log", args.log, "--json", out, "--quiet"], check=True)
+                with open(out, "r", encoding="utf-8") as f:
+                    result = json.load(f)[0]
+        results.append(result)
+        if not args.quiet:
+            print_collect(result, baseline.get((result["bonds"], result["engine"])))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+
+
+# ---- История запусков: запись и чтение диапазона дат с отображением файлов в память ----
+def _current_rss_mb():
+    """Текущая память процесса, МБ: (своя — куча и т.п., отображённые файлы); None там, где нет /proc."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if line.startswith(("RssAnon", "RssFile")))
+        return tuple(int(fields[name].split()[0]) / 2 ** 10 for name in ("RssAnon", "RssFile"))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def synthetic_history_table(bl, bonds: int, run_at, rng):
+    """Один запуск для истории: bonds строк в схеме bl.history_schema() со случайными значениями."""
+    import pyarrow as pa
+    ratings = np.array(["Не оценен", "AAA(RU)", "AA(RU)", "A+(RU)", "BBB-(RU)", "Отсутствует"], dtype=object)
+    sectors = np.array(["Финансы", "Энергетика", "Государственный", "Муниципальный", "ИТ"], dtype=object)
+    names = np.array([f"RU000A{i:06d}" for i in range(bonds)], dtype=object)
+    arrays = []
+    for field in bl.history_schema():
+        if field.name == "run_at":
+            values = np.full(bonds, bl.to_us(run_at), dtype=np.int64)
+        elif pa.types.is_dictionary(field.type):
+            values = (sectors if field.name == "Сектор" else ratings)[rng.integers(0, 5, bonds)]
+        elif pa.types.is_string(field.type):
+            values = names
+        elif pa.types.is_floating(field.type):
+            values = np.round(rng.uniform(0, 1000, bonds), 2)
+        else:
+            values = rng.integers(1, 4, bonds)
+        arrays.append(pa.array(values, type=field.type))
+    return pa.table(arrays, schema=bl.history_schema())
+
+
+def bench_history(days: int, bonds: int, seed: int):
+    import gc
+    import pyarrow.compute as pc
+    from datetime import datetime, timedelta, timezone
+    import bondsList as bl
+
+    rng = np.random.default_rng(seed)
+    first = datetime(2024, 1, 1, 16, 0, tzinfo=timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="bench-history-") as directory:
+        started = time.perf_counter()
+        for day in range(days):
+            run_at = first + timedelta(days=day)
+            bl.write_history(synthetic_history_table(bl, bonds, run_at, rng), run_at, directory)
+        write_seconds = time.perf_counter() - started
+        files = bl.history_files(directory=directory)
+        size_mb = sum(os.path.getsize(path) for path in files) / 2 ** 20
+        print(f"write: {days} days x {bonds} bonds in {write_seconds:.2f} s, {len(files)} files, {size_mb:.1f} MB")
+        gc.collect()
+
+        def timed_read(label, **kwargs):
+            rss_before = _current_rss_mb()
+            started = time.perf_counter()
+            table = bl.read_history(directory=directory, **kwargs)
+            # пройти по всем значениям выбранных столбцов, чтобы страницы действительно прочитались
+            for name in table.column_names:
+                pc.count(table.column(name))
+            if "Годовая_доходность" in table.column_names:
+                pc.mean(table.column("Годовая_доходность"))
+            seconds = time.perf_counter() - started
+            rss_after = _current_rss_mb()
+            # страницы отображённых файлов — это кэш ОС, их ядро может вытеснить; своя память — то, что прочитано в кучу
+            rss = (f", own memory +{rss_after[0] - rss_before[0]:.1f} MB, mapped +{rss_after[1] - rss_before[1]:.1f} MB"
+                   if rss_before is not None else "")
+            print(f"{label}: {table.num_rows} rows x {table.num_columns} columns in {seconds * 1000:.1f} ms{rss}")
+
+        # первое чтение подгружает модули и пул памяти pyarrow — в замеры это не должно попадать
+        timed_read("warm-up, 1 day", start=first.date(), end=first.date())
+        timed_read("year, 3 columns", columns=["run_at", "isin", "Годовая_доходность"])
+        month_end = (first + timedelta(days=29)).date()
+        timed_read("month, all columns", start=first.date(), end=month_end)
+        timed_read("year, all columns")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности расчётов по облигациям.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ytm = sub.add_parser("ytm", help="Пакетный решатель доходности против поштучного эталона")
+    ytm.add_argument("--bonds", type=int, default=5000)
+    ytm.add_argument("--seed", type=int, default=0)
+
+    scenarios = sub.add_parser("scenarios", help="Переоценка под сценариями ставок против поштучного расчёта")
+    scenarios.add_argument("--bonds", type=int, default=5000)
+    scenarios.add_argument("--scenarios", type=int, default=24)
+    scenarios.add_argument("--seed", type=int, default=0)
+
+    startup = sub.add_parser("startup", help="Время запуска главного скрипта до разбора аргументов")
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("--max-ms", type=float,
+                         help="Проверка: ошибка, если медиана --version дольше или при импорте грузятся тяжёлые модули")
+
+    history = sub.add_parser("history", help="Запись истории запусков и чтение диапазона дат через read_history()")
+    history.add_argument("--days", type=int, default=365)
+    history.add_argument("--bonds", type=int, default=2000)
+    history.add_argument("--seed", type=int, default=0)
+
+    collect = sub.add_parser("collect", help="collect_bonds() целиком на синтетических облигациях и локальных заглушках")
+    collect.add_argument("--bonds", type=int, nargs="+", default=[1000],
+                         help="Размеры набора, например 1000 10000 100000 (каждый — отдельным процессом)")
+    collect.add_argument("--engine", choices=["serial", "pipeline", "async"], default="pipeline")
+    collect.add_argument("--seed", type=int, default=0)
+    collect.add_argument("--latency", type=float, default=0.01, help="Задержка ответа API Тинькофф, сек")
+    collect.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке API, до стольких сек")
+    collect.add_argument("--error-rate", type=float, default=0.0, help="Доля вызовов API, завершающихся ошибкой gRPC")
+    collect.add_argument("--http-latency", type=float, default=0.005, help="Задержка ответа сайтов рейтингов, сек")
+    collect.add_argument("--api-delay", type=float, default=0.0, help="API_DELAY (пауза между страницами АКРА)")
+    collect.add_argument("--quota", type=int, help="Квота API: вызовов метода в секунду, сверх — RESOURCE_EXHAUSTED")
+    collect.add_argument("--parse-workers", type=int, help="PARSE_WORKERS: процессов разбора страниц, 0 — в том же потоке")
+    collect.add_argument("--rate-limits", default="{}", help='RATE_LIMITS в JSON, по умолчанию без ограничений')
+    collect.add_argument("--screen", default="{}", help='SCREEN в JSON (отсев до ИНН и рейтингов), по умолчанию без отсева')
+    collect.add_argument("--repeat", type=int, default=1, help="Повторы в том же каталоге: со 2-го — с кэшем")
+    collect.add_argument("--json", help="Записать результаты в файл (JSON)")
+    collect.add_argument("--baseline", help="Сравнить с результатами из файла, записанного --json")
+    collect.add_argument("--quiet", action="store_true", help=argparse.SUPPRESS)
+    collect.add_argument("--log", default="ERROR")
+
+    args = parser.parse_args()
+    if args.command == "collect":
+        logging.basicConfig(level=getattr(logging, args.log.upper(), logging.ERROR),
+                            format="%(asctime)s %(levelname)s: %(message)s")
+        run_collect(args)
+    elif args.command == "ytm":
+        bench_ytm(args.bonds, args.seed)
+    elif args.command == "scenarios":
+        bench_scenarios(args.bonds, args.scenarios, args.seed)
+    elif args.command == "startup":
+        bench_startup(args.runs, args.max_ms)
+    elif args.command == "history":
+        bench_history(args.days, args.bonds, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import asyncio
+import io
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace as NS
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from grpc import StatusCode
+from tinkoff.invest.exceptions import AioRequestError, RequestError
+
+# Подставные источники для bench.py: синтетический набор облигаций, клиент Тинькофф в том же процессе
+# и локальные HTTP-заглушки isin.ru, АКРА, НРА и НКР. Ответы повторяют поля и разметку, которые
+# читает bondsList, — ни токен, ни интернет не нужны.
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+SECTORS = ["financial", "consumer", "real_estate", "materials", "utilities", "telecom", "industrials",
+           "it", "energy", "municipal", "government"]
+RATINGS = ["AAA(RU)", "AA+(RU)", "AA(RU)", "AA-(RU)", "A+(RU)", "A(RU)", "A-(RU)", "BBB+(RU)", "BBB(RU)", "BB(RU)"]
+
+
+def _money(value):
+    units = int(value)
+    return NS(units=units, nano=int(round((value - units) * 1e9)))
+
+
+# ---- Синтетический набор облигаций ----
+class SyntheticUniverse:
+    """n облигаций с реалистичными полями; у каждых issuer_size выпусков подряд один эмитент.
+
+    Расписания купонов хранятся параметрами (первая дата, шаг, размер) и разворачиваются в события
+    только при запросе — на 100k облигаций это сотни мегабайт экономии.
+    """
+
+    def __init__(self, n: int, seed: int = 0, issuer_size: int = 3):
+        rng = np.random.default_rng(seed)
+        self.now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.issuer_size = issuer_size
+
+        per_year = rng.choice([1, 2, 4, 12], size=n, p=[0.1, 0.4, 0.3, 0.2])
+        maturity_days = rng.integers(30, 365 * 15, size=n)
+        self.step_days = 365 // per_year
+        self.first_days = rng.integers(1, self.step_days + 1)
+        self.coupon = np.round(rng.uniform(5, 60, size=n), 2)
+        self.maturity = [self.now + timedelta(days=int(d)) for d in maturity_days]
+        # ~3% выпусков с ещё не объявленным (нулевым) купоном, как флоатеры в реальных данных
+        self.unknown_coupon = rng.random(n) < 0.03
+        sectors = rng.choice(SECTORS, size=n, p=[0.2, 0.1, 0.1, 0.1, 0.08, 0.05, 0.1, 0.05, 0.07, 0.05, 0.1])
+        nominal = rng.choice([1000.0, 1000.0, 500.0, 100.0], size=n)
+        aci = np.round(rng.uniform(0, 30, size=n), 2)
+        prices = np.round(rng.uniform(70, 110, size=n), 3)
+        has_price = rng.random(n) > 0.03
+        # ~5% отсеиваются фильтром is_available_bond
+        tradable = rng.random(n) > 0.05
+
+        call_date = _EPOCH
+        nominals = {v: _money(v) for v in np.unique(nominal)}
+        self.bonds = []
+        self.prices = {}
+        for i in range(n):
+            figi = f"BBG{i:09d}"
+            self.bonds.append(NS(
+                figi=figi, isin=self.isin(i), name=f"Облигация {i}", ticker=f"SU{i:06d}",
+                uid=f"uid-{i}", asset_uid=f"asset-{i}",
+                buy_available_flag=bool(tradable[i]), floating_coupon_flag=False, amortization_flag=False,
+                for_qual_investor_flag=False, currency="rub", class_code="TQCB",
+                coupon_quantity_per_year=int(per_year[i]), call_date=call_date,
+                maturity_date=self.maturity[i], nominal=nominals[nominal[i]], aci_value=_money(aci[i]),
+                sector=str(sectors[i]), risk_level=NS(value=int(i % 4)),
+            ))
+            if has_price[i]:
+                self.prices[figi] = _money(prices[i])
+        self._index = {b.figi: i for i, b in enumerate(self.bonds)}
+        self._assets = {b.asset_uid: i for i, b in enumerate(self.bonds)}
+
+    def __len__(self):
+        return len(self.bonds)
+
+    @staticmethod
+    def isin(i: int) -> str:
+        return f"RU000A{i:05d}0" if i < 100_000 else f"RU00{i:07d}0"
+
+    def issuer_itn(self, i: int) -> str:
+        return str(7700000000 + i // self.issuer_size)
+
+    def asset(self, asset_uid):
+        """Актив выпуска, как в get_asset_by: заёмщик в security.bond.borrow_name."""
+        i = self._assets[asset_uid]
+        return NS(uid=asset_uid, security=NS(isin=self.isin(i), bond=NS(borrow_name=f"ПАО Эмитент {i // self.issuer_size}")))
+
+    def coupons(self, figi, date_from, date_to):
+        i = self._index[figi]
+        value = _money(0.0 if self.unknown_coupon[i] else self.coupon[i])
+        events = []
+        d = self.now + timedelta(days=int(self.first_days[i]))
+        end = min(date_to, self.maturity[i] + timedelta(days=1))
+        while d <= end:
+            if d >= date_from:
+                events.append(NS(figi=figi, coupon_date=d, pay_one_bond=value))
+            d += timedelta(days=int(self.step_days[i]))
+        return events
+
+
+# ---- Клиент Тинькофф в том же процессе ----
+def _fault(code, remaining=None, reset=None):
+    """Аргументы RequestError/AioRequestError SDK: код, текст и метаданные с ratelimit_* ответа."""
+    return code, "injected by benchStubs", NS(ratelimit_remaining=remaining, ratelimit_reset=reset)
+
+
+class FakeApi:
+    """Задержка и доля ошибок на каждый вызов; считает вызовы, ошибки и время по методам.
+
+    quota — сколько вызовов каждого метода разрешено за окно quota_window секунд; сверх него
+    RESOURCE_EXHAUSTED с остатком и временем до сброса окна, как у настоящего API.
+    """
+
+    def __init__(self, universe: SyntheticUniverse, latency=0.0, jitter=0.0, error_rate=0.0, seed=0,
+                 quota=None, quota_window=1.0):
+        self.universe = universe
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota = quota
+        self.quota_window = quota_window
+        self.stats = {}
+        self._windows = {}  # метод -> (начало окна, вызовов в окне)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _delay_and_fault(self, method):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self.quota:
+                now = time.monotonic()
+                start, used = self._windows.get(method, (now, 0))
+                if now - start >= self.quota_window:
+                    start, used = now, 0
+                self._windows[method] = (start, used + 1)
+                if used >= self.quota:
+                    return delay, _fault(StatusCode.RESOURCE_EXHAUSTED, 0, self.quota_window - (now - start))
+            if self._random.random() < self.error_rate:
+                return delay, _fault(self._random.choice([StatusCode.INTERNAL, StatusCode.UNAVAILABLE]))
+        return delay, None
+
+    def _record(self, method, seconds, failed):
+        with self._lock:
+            calls, errors, total = self.stats.get(method, (0, 0, 0.0))
+            self.stats[method] = (calls + 1, errors + failed, total + seconds)
+
+    def call(self, method, fn):
+        delay, error = self._delay_and_fault(method)
+        time.sleep(delay)
+        self._record(method, delay, error is not None)
+        if error is not None:
+            raise RequestError(*error)
+        return fn()
+
+    async def call_async(self, method, fn):
+        delay, error = self._delay_and_fault(method)
+        await asyncio.sleep(delay)
+        self._record(method, delay, error is not None)
+        if error is not None:
+            raise AioRequestError(*error)
+        return fn()
+
+    # ответы в форме SDK
+    def bonds_response(self):
+        return NS(instruments=self.universe.bonds)
+
+    def coupons_response(self, figi, from_, to):
+        return NS(events=self.universe.coupons(figi, from_, to))
+
+    def asset_response(self, id):
+        return NS(asset=self.universe.asset(id))
+
+    def prices_response(self, figi):
+        prices = self.universe.prices
+        return NS(last_prices=[NS(figi=f, price=prices[f], time=self.universe.now) for f in figi if f in prices])
+
+
+class FakeClient:
+    """То, что bondsList использует из tinkoff.invest.Client."""
+
+    def __init__(self, api: FakeApi):
+        self.instruments = NS(
+            bonds=lambda: api.call("bonds", api.bonds_response),
+            get_bond_coupons=lambda figi, from_, to: api.call(
+                "get_bond_coupons", lambda: api.coupons_response(figi, from_, to)),
+            get_asset_by=lambda id: api.call("get_asset_by", lambda: api.asset_response(id)),
+        )
+        self.market_data = NS(
+            get_last_prices=lambda figi: api.call("get_last_prices", lambda: api.prices_response(figi)),
+        )
+
+
+class FakeAsyncClient:
+    """То же для AsyncClient; сам себе асинхронный контекстный менеджер."""
+
+    def __init__(self, api: FakeApi):
+        async def bonds():
+            return await api.call_async("bonds", api.bonds_response)
+
+        async def get_bond_coupons(figi, from_, to):
+            return await api.call_async("get_bond_coupons", lambda: api.coupons_response(figi, from_, to))
+
+        async def get_asset_by(id):
+            return await api.call_async("get_asset_by", lambda: api.asset_response(id))
+
+        async def get_last_prices(figi):
+            return await api.call_async("get_last_prices", lambda: api.prices_response(figi))
+
+        self.instruments = NS(bonds=bonds, get_bond_coupons=get_bond_coupons, get_asset_by=get_asset_by)
+        self.market_data = NS(get_last_prices=get_last_prices)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# ---- Локальные HTTP-заглушки isin.ru, АКРА, НРА, НКР ----
+ACRA_PAGE_SIZE = 100
+
+
+def _rating_xlsx(universe: SyntheticUniverse, itn_column: str, rating_column: str, seed: int) -> bytes:
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    issuers = np.arange(0, len(universe), universe.issuer_size)
+    # рейтинг есть примерно у половины эмитентов
+    rated = issuers[rng.random(len(issuers)) < 0.5]
+    df = pd.DataFrame({
+        itn_column: [int(universe.issuer_itn(i)) for i in rated],
+        rating_column: rng.choice(RATINGS, size=len(rated)),
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, engine="xlsxwriter")
+    return buffer.getvalue()
+
+
+class RatingSites:
+    """Все четыре сайта на одном локальном порту: /isin/, /acra/, /nra.xlsx, /nkr.xlsx."""
+
+    def __init__(self, universe: SyntheticUniverse, latency=0.0, seed=0):
+        self.universe = universe
+        self.latency = latency
+        self.requests = {}
+        rng = np.random.default_rng(seed)
+        # ИНН на isin.ru находится для ~90% выпусков, рейтинг АКРА — у ~20%
+        self.itn_known = rng.random(len(universe)) < 0.9
+        acra = np.flatnonzero(rng.random(len(universe)) < 0.2)
+        self.acra_rows = [(universe.isin(i), RATINGS[i % len(RATINGS)]) for i in acra]
+        self.files = {
+            "/nra.xlsx": _rating_xlsx(universe, "ИНН", "Рейтинг", seed + 1),
+            "/nkr.xlsx": _rating_xlsx(universe, "TIN", "Rating", seed + 2),
+        }
+        self._lock = threading.Lock()
+        self._server = None
+
+    # адреса, которые подставляются в bondsList
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def urls(self):
+        return {
+            "ISIN_RU_URL": self.base_url + "/isin/",
+            "ACRA_ISSUES_URL": self.base_url + "/acra/",
+            "NRA_RATINGS_URL": self.base_url + "/nra.xlsx",
+            "NKR_RATINGS_URL": self.base_url + "/nkr.xlsx",
+        }
+
+    def start(self):
+        sites = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # заголовки и тело уходят разными write — без TCP_NODELAY каждый ответ ждал бы delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                sites._serve(self, "GET")
+
+            def do_POST(self):
+                sites._serve(self, "POST")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="rating-sites", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _serve(self, handler, method):
+        url = urlsplit(handler.path)
+        route = url.path.strip("/").split("/")[0]
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        length = int(handler.headers.get("Content-Length") or 0)
+        form = parse_qs(handler.rfile.read(length).decode()) if length else {}
+        status, content_type, body = self._respond(method, url.path, parse_qs(url.query), form)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _respond(self, method, path, query, form):
+        html = "text/html; charset=utf-8"
+        if path == "/isin/" and method == "POST":
+            isin = form.get("input_from_isin", [""])[0]
+            i = self._isin_index(isin)
+            if i is None or not self.itn_known[i]:
+                return 200, html, "<html><body>Ничего не найдено</body></html>"
+            return 200, html, f'<html><body><a href="index.php?type=issue_id&id={i}">{isin}</a></body></html>'
+        if path == "/isin/index.php":
+            i = int(query.get("id", ["0"])[0])
+            # разметка подобрана под разбор в fetch_company_itn: число через 16 символов после «ИНН»
+            return 200, html, f"<table><tr><td>ИНН:</td>\n  <td>{self.universe.issuer_itn(i)}</td></tr></table>"
+        if path == "/acra/":
+            page = int(query.get("page", ["1"])[0])
+            rows = self.acra_rows[(page - 1) * ACRA_PAGE_SIZE:page * ACRA_PAGE_SIZE]
+            if not rows:
+                return 404, html, "Not found"
+            body = "".join(f"<tr><td>{isin}</td><td>{rating}</td></tr>" for isin, rating in rows)
+            return 200, html, f"<table>{body}</table>"
+        if path in self.files:
+            return 200, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", self.files[path]
+        return 404, html, "Not found"
+
+    def _isin_index(self, isin):
+        try:
+            return int(isin[6:11]) if isin.startswith("RU000A") else int(isin[4:11])
+        except ValueError:
+            return None
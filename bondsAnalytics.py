@@ -0,0 +1,232 @@
+import numpy as np
+
+DIV = 1_000_000_000
+DAYS_IN_YEAR = 365.25
+TAX = 0.87
+
+# ---- Векторные расчёты по всей выборке облигаций сразу ----
+# На вход — столбцы (по одному элементу на облигацию) и плоский массив купонов всех облигаций
+# с границами offsets: купоны облигации i лежат в [offsets[i], offsets[i + 1]).
+# Формулы повторяют прежний построчный расчёт из bondsList.collect_bonds один в один.
+
+
+def money(units, nano):
+    """units + nano / DIV для массивов, как для отдельного Quotation/MoneyValue."""
+    return np.asarray(units, dtype=np.int64) + np.asarray(nano, dtype=np.int64) / DIV
+
+
+def round_like_python(values, ndigits):
+    # np.round умножает на 10**n и округляет до чётного — на «ничьих» вида 0.1235 это расходится
+    # со встроенным round(), который смотрит на точное десятичное значение. Итоговых чисел по одному
+    # на облигацию, поэтому для точного совпадения округляем их встроенным round().
+    return np.fromiter((round(v, ndigits) for v in np.asarray(values, dtype=np.float64).tolist()),
+                       dtype=np.float64, count=len(values))
+
+
+def pad_coupons(offsets, *flat_arrays):
+    """Раскладывает плоские массивы купонов в матрицы (облигации x купоны), дополняя нулями."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    n, width = len(counts), int(counts.max()) if len(counts) else 0
+    rows = np.repeat(np.arange(n), counts)
+    cols = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+    matrices = []
+    for flat in flat_arrays:
+        m = np.zeros((n, width), dtype=np.asarray(flat).dtype)
+        m[rows, cols] = flat
+        matrices.append(m)
+    return counts, matrices
+
+
+def bond_metrics(quote, has_price, nominal, aci, coupons_per_year, maturity_days,
+                 coupon_values, coupon_days, offsets):
+    """Цена + НКД, первый купон, годовая доходность, простая доходность к погашению,
+    лет до погашения и недисконтированная дюрация для всех облигаций.
+
+    quote — цена в процентах от номинала, maturity_days и coupon_days — целые дни от текущего момента.
+    Доходность к погашению, которую нельзя посчитать из-за неизвестного купона, — NaN в ytm
+    и True в ytm_na.
+    """
+    quote = np.asarray(quote, dtype=np.float64)
+    nominal = np.asarray(nominal, dtype=np.float64)
+    aci = np.asarray(aci, dtype=np.float64)
+    coupons_per_year = np.asarray(coupons_per_year, dtype=np.int64)
+    maturity_days = np.asarray(maturity_days, dtype=np.int64)
+    coupon_values = np.asarray(coupon_values, dtype=np.float64)
+    coupon_days = np.asarray(coupon_days, dtype=np.int64)
+
+    # как было: денежная цена = котировка/100 * номинал
+    price_clean = np.where(has_price, quote / 100.0 * nominal, 0.0)
+    price_dirty = price_clean + aci
+
+    counts, (values_m, years_m) = pad_coupons(offsets, coupon_values,
+                                              np.round(coupon_days / DAYS_IN_YEAR, 2))
+    first_coupon = np.where(counts > 0, values_m[:, 0] if values_m.shape[1] else 0.0, 0.0)
+
+    # суммы — последовательно по столбцам, в том же порядке, что и прежний цикл по купонам
+    duration_acc = np.zeros(len(counts))
+    coupon_income = np.zeros(len(counts))
+    for k in range(values_m.shape[1]):
+        duration_acc += values_m[:, k] * years_m[:, k]
+        coupon_income += values_m[:, k]
+    # нулевой купон — ещё не объявленный (флоатеры и т.п.); дополнение нулями не в счёт
+    unknown = (values_m == 0) & (np.arange(values_m.shape[1]) < counts[:, None])
+    ytm_na = unknown.any(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        year_yield = (TAX * (first_coupon * coupons_per_year)) / price_dirty
+        years_to_maturity = round_like_python(maturity_days / DAYS_IN_YEAR, 1)
+        common_income = coupon_income + nominal
+        duration = (duration_acc + nominal * years_to_maturity) / common_income
+        ytm = (TAX * 365 * (coupon_income + nominal - price_clean - aci) /
+               (maturity_days * price_dirty))
+
+    # деление на ноль раньше ловилось except'ом и давало 0.0
+    year_yield = np.where(price_dirty != 0, year_yield, 0.0)
+    duration = np.where(common_income != 0, duration, 0.0)
+    ytm = np.where((maturity_days != 0) & (price_dirty != 0), ytm, 0.0)
+
+    return {
+        "price_dirty": round_like_python(price_dirty, 2),
+        "coupon": round_like_python(first_coupon, 2),
+        "yield": round_like_python(year_yield, 3) * 100,
+        "ytm": np.where(ytm_na, np.nan, round_like_python(ytm, 3) * 100),
+        "ytm_na": ytm_na,
+        "years_to_maturity": years_to_maturity,
+        "duration": round_like_python(duration, 2),
+    }
+
+
+# ---- Дисконтированные показатели: доходность к погашению через IRR, дюрация Маколея, выпуклость ----
+# Решаем price = sum(cf * (1 + y) ** -t) сразу для всех облигаций: шаг Ньютона, а если он выходит
+# за текущую вилку [lo, hi] — деление вилки пополам. Годовая сложная доходность, без учёта налога.
+YTM_LOWER = -0.99
+YTM_UPPER = 10.0
+
+
+def cashflow_matrix(nominal, maturity_days, coupon_values, coupon_days, offsets):
+    """Матрицы потоков и сроков (в годах): купоны облигации и номинал в дату погашения последним столбцом."""
+    counts, (values_m, days_m) = pad_coupons(offsets, np.asarray(coupon_values, dtype=np.float64),
+                                             np.asarray(coupon_days, dtype=np.int64))
+    cashflows = np.column_stack((values_m, np.asarray(nominal, dtype=np.float64)))
+    times = np.column_stack((days_m, np.asarray(maturity_days, dtype=np.int64))) / DAYS_IN_YEAR
+    # дополнение нулями не должно влиять: нулевой поток на сроке 0
+    return cashflows, times
+
+
+def _present_values(cashflows, times, y):
+    return cashflows * np.exp(-times * np.log1p(y)[:, None])
+
+
+def solve_ytm(price, cashflows, times, valid=None, tol=1e-10, max_iter=100):
+    """Доходность y для каждой строки: sum(cashflows * (1 + y) ** -times) == price. NaN, если решения нет."""
+    price = np.asarray(price, dtype=np.float64)
+    n = len(price)
+    valid = np.ones(n, dtype=bool) if valid is None else np.asarray(valid, dtype=bool).copy()
+    valid &= (price > 0) & (cashflows.sum(axis=1) > 0)
+
+    lo = np.full(n, YTM_LOWER)
+    hi = np.full(n, YTM_UPPER)
+    # потоки неотрицательны, поэтому цена убывает по y: корень есть, только если он внутри вилки
+    with np.errstate(over="ignore", invalid="ignore"):
+        valid &= (_present_values(cashflows, times, lo).sum(axis=1) > price)
+        valid &= (_present_values(cashflows, times, hi).sum(axis=1) < price)
+
+    y = np.where(valid, 0.1, np.nan)
+    active = valid.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        ya, cf, t = y[idx], cashflows[idx], times[idx]
+        pv = _present_values(cf, t, ya)
+        f = pv.sum(axis=1) - price[idx]
+        df = -(t * pv).sum(axis=1) / (1 + ya)
+
+        lo[idx] = np.where(f > 0, ya, lo[idx])
+        hi[idx] = np.where(f > 0, hi[idx], ya)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = ya - f / df
+        inside = np.isfinite(step) & (step > lo[idx]) & (step < hi[idx])
+        done = (np.abs(f) <= tol * price[idx]) | (hi[idx] - lo[idx] <= tol)
+        y[idx] = np.where(done, ya, np.where(inside, step, (lo[idx] + hi[idx]) / 2))
+        active[idx[done]] = False
+    return y
+
+
+def discounted_metrics(price_dirty, cashflows, times, valid=None):
+    """Эффективная доходность к погашению (IRR), дюрация Маколея, модифицированная дюрация и выпуклость."""
+    y = solve_ytm(price_dirty, cashflows, times, valid)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        pv = _present_values(cashflows, times, np.nan_to_num(y))
+        value = pv.sum(axis=1)
+        macaulay = (times * pv).sum(axis=1) / value
+        convexity = (times * (times + 1) * pv).sum(axis=1) / (value * (1 + y) ** 2)
+        modified = macaulay / (1 + y)
+    unsolved = np.isnan(y)
+    return {
+        "irr": y,
+        "macaulay": np.where(unsolved, np.nan, macaulay),
+        "modified": np.where(unsolved, np.nan, modified),
+        "convexity": np.where(unsolved, np.nan, convexity),
+    }
+
+
+def ytm_scalar(price, cashflows, times, tol=1e-10, max_iter=100):
+    """Эталон для проверки solve_ytm: та же схема, но по одной облигации на чистом Python."""
+    def value(y):
+        return sum(cf * (1 + y) ** -t for cf, t in zip(cashflows, times))
+
+    lo, hi = YTM_LOWER, YTM_UPPER
+    if price <= 0 or not value(lo) > price > value(hi):
+        return float("nan")
+    y = 0.1
+    for _ in range(max_iter):
+        f = value(y) - price
+        df = -sum(t * cf * (1 + y) ** (-t - 1) for cf, t in zip(cashflows, times))
+        if f > 0:
+            lo = y
+        else:
+            hi = y
+        if abs(f) <= tol * price or hi - lo <= tol:
+            break
+        step = y - f / df if df else float("nan")
+        y = step if lo < step < hi else (lo + hi) / 2
+    return y
+
+
+# ---- Сценарии ставок: переоценка всех облигаций сразу под набором сдвигов кривой ----
+# Каждый поток дисконтируется по эффективной доходности облигации плюс сдвиг сценария на сроке
+# этого потока, так что без сдвига цена совпадает с текущей. Сценарии считаются блоками, чтобы
+# промежуточный массив (сценарии x потоки всех облигаций) не превышал SCENARIO_BLOCK элементов.
+SCENARIO_BLOCK = 4_000_000
+
+
+def scenario_shifts(curves, times):
+    """Сдвиги доходности (в долях) по сценариям для матрицы сроков times: форма (сценарии, *times.shape).
+    Кривая сценария — точки (лет, б.п.): между ними линейно, за крайними — как в крайней точке."""
+    shifts = np.empty((len(curves), *times.shape))
+    for k, curve in enumerate(curves):
+        years, bp = np.asarray(curve, dtype=np.float64).reshape(-1, 2).T
+        order = np.argsort(years)
+        shifts[k] = np.interp(times, years[order], bp[order]) / 10_000
+    return shifts
+
+
+def scenario_prices(cashflows, times, y, curves):
+    """Цены облигаций под каждым сценарием: матрица (сценарии x облигации), NaN — где y не посчитана."""
+    y = np.asarray(y, dtype=np.float64)
+    # считаем только настоящие потоки: в матрице короткие облигации дополнены нулями до самой длинной
+    rows, cols = np.nonzero(cashflows)
+    flows, flow_times = cashflows[rows, cols], times[rows, cols]
+    flow_y = y[rows]
+    prices = np.empty((len(curves), len(y)))
+    block = max(1, SCENARIO_BLOCK // max(len(flows), 1))
+    for start in range(0, len(curves), block):
+        shifts = scenario_shifts(curves[start:start + block], flow_times)
+        with np.errstate(invalid="ignore", over="ignore"):
+            values = flows * np.exp(-flow_times * np.log1p(flow_y + shifts))
+        for k, scenario_values in enumerate(values, start):
+            prices[k] = np.bincount(rows, weights=scenario_values, minlength=len(y))
+    prices[:, np.isnan(y)] = np.nan
+    return prices
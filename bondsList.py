@@ -1,76 +1,205 @@
 import os
+import sys
 import time
 import json
 import math
 import argparse
+import importlib.util
 import logging
-import requests
-import xlsxwriter
-import pandas as pd
-from tqdm import tqdm
-from dataclasses import dataclass, asdict
+import queue
+import threading
+from urllib.parse import urlsplit
 from datetime import datetime, timezone, timedelta
-from subprocess import Popen
-import winreg
-
-from tinkoff.invest import Client
-from tinkoff.invest.utils import quotation_to_decimal
-from bs4 import BeautifulSoup
 from functools import lru_cache
 import random
-from grpc import RpcError, StatusCode
-
+import re
+import sqlite3
+import tempfile
+from collections import namedtuple
+from enum import Enum
+
+__version__ = "1.1.0"
+
+# ---- Ленивые импорты ----
+# Тяжёлые библиотеки (NumPy, pandas, requests, asyncio) грузятся при первом обращении, SDK Тинькофф,
+# grpc, tqdm, winreg и расчёты из bondsAnalytics импортируются внутри функций, которым они нужны. Так --help/--version и импорт
+# модуля не тратят время на всё сразу, а на Linux модуль импортируется без winreg.
+def _lazy_import(name):
+    """Модуль, который на самом деле выполнится при первом обращении к его атрибуту."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+np = _lazy_import("numpy")
+pd = _lazy_import("pandas")
+requests = _lazy_import("requests")
+asyncio = _lazy_import("asyncio")
+
+
+def _smart_retry_pause(err, attempt, delay):
+    """Пауза перед следующей попыткой и новый базовый бэкофф для INTERNAL.
+    err — RequestError/AioRequestError SDK или grpc.RpcError (см. grpc_code)."""
+    code = grpc_code(err)
+    if code is not None:
+        from grpc import StatusCode
+        # квота исчерпана — ждём сброса окна (ограничитель метода заодно притормозит остальные потоки)
+        if code == StatusCode.RESOURCE_EXHAUSTED:
+            reset = ratelimit_metadata(err)[1]
+            return (reset if reset else delay), delay * 2
+        # на INTERNAL увеличиваем бэкофф заметнее
+        if code == StatusCode.INTERNAL:
+            jitter = random.uniform(0, 0.25)
+            return delay + jitter, delay * 2  # экспоненциально
+    # для других ошибок — используй обычный бэкофф
+    return 0.5 * (2 ** attempt), delay
 
 def get_coupons_with_smart_retry(client, figi, date_from, date_to, max_retries=5):
     delay = 0.5
     last_err = None
     for i in range(max_retries):
+        time.sleep(tinkoff_wait("get_bond_coupons"))
+        started = time.monotonic()
         try:
-            return client.instruments.get_bond_coupons(figi=figi, from_=date_from, to=date_to).events
-        except RpcError as e:
+            events = client.instruments.get_bond_coupons(figi=figi, from_=date_from, to=date_to).events
+        except Exception as e:
             last_err = e
-            code = getattr(e, "code", lambda: None)()
-            # на INTERNAL увеличиваем бэкофф заметнее
-            if code == StatusCode.INTERNAL:
-                jitter = random.uniform(0, 0.25)
-                time.sleep(delay + jitter)
-                delay *= 2  # экспоненциально
-                continue
-            # для других ошибок — используй обычный бэкофф
-            time.sleep(0.5 * (2 ** i))
+            tinkoff_feedback("get_bond_coupons", e)
+            # после последней попытки не ждём — сразу отдаём ошибку
+            if i == max_retries - 1:
+                record_failed_call("tinkoff", "get_bond_coupons", started, e)
+                break
+            pause, delay = _smart_retry_pause(e, i, delay)
+            record_failed_call("tinkoff", "get_bond_coupons", started, e, pause)
+            time.sleep(pause)
+        else:
+            tinkoff_feedback("get_bond_coupons")
+            record_call("tinkoff", "get_bond_coupons", started, "OK")
+            return events
+    raise last_err
+
+async def get_coupons_with_smart_retry_async(client, figi, date_from, date_to, max_retries=5):
+    delay = 0.5
+    last_err = None
+    for i in range(max_retries):
+        await asyncio.sleep(tinkoff_wait("get_bond_coupons"))
+        started = time.monotonic()
+        try:
+            events = (await client.instruments.get_bond_coupons(figi=figi, from_=date_from, to=date_to)).events
         except Exception as e:
             last_err = e
-            time.sleep(0.5 * (2 ** i))
+            tinkoff_feedback("get_bond_coupons", e)
+            # после последней попытки не ждём — сразу отдаём ошибку
+            if i == max_retries - 1:
+                record_failed_call("tinkoff", "get_bond_coupons", started, e)
+                break
+            pause, delay = _smart_retry_pause(e, i, delay)
+            record_failed_call("tinkoff", "get_bond_coupons", started, e, pause)
+            await asyncio.sleep(pause)
+        else:
+            tinkoff_feedback("get_bond_coupons")
+            record_call("tinkoff", "get_bond_coupons", started, "OK")
+            return events
     raise last_err
 
 # ---- Глобальные настройки / совместимость со старым кодом ----
-requests.packages.urllib3.disable_warnings()  # (№7 не внедряем таймауты/verify=True)
-
 DIV = 1_000_000_000
+# момент, от которого считаются сроки; обновляется в начале каждого прохода (refresh_clock)
 UTCNOW = datetime.now(timezone.utc)
 
 TOKEN = ""
 API_DELAY = 0.5
 EXCEL_TABLE_NAME = "bonds.xlsx"
+OUTPUT_FORMAT = "xlsx"
 FOR_QUAL_INVESTOR = None
 AMORTIZATION = False
 FLOATING_COUPON = False
 NOT_WRITE_WITHOUT_RATING = False
+# сценарии ставок для --scenarios: имя -> кривая сдвига доходности, точки [лет, б.п.] (между ними линейно)
+SCENARIOS = {
+    "+100": [[0, 100]], "+200": [[0, 200]], "+300": [[0, 300]],
+    "-100": [[0, -100]], "-200": [[0, -200]], "-300": [[0, -300]],
+    "Наклон+100": [[1, -50], [10, 50]], "Наклон-100": [[1, 50], [10, -50]],
+}
+WITH_SCENARIOS = False
+
+# конвейерный режим: размер очередей между стадиями и число потоков на стадию
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_WORKERS = {"coupons": 4, "itn": 4, "ratings": 2}
+# ограничение запросов в секунду на каждый внешний источник (0 или отсутствие — без ограничения)
+RATE_LIMITS = {"tinkoff": 3, "isin.ru": 2, "acra": 1, "nra": 1, "nkr": 1}
+# HTTP к сайтам рейтингов и isin.ru: соединений в пуле на хост и таймауты (сек) по хосту
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUTS = {"default": 30, "www.isin.ru": 20, "www.acra-ratings.ru": 20, "www.ra-national.ru": 60, "ratings.ru": 60}
+# отсев до запросов ИНН и рейтингов: мин. годовая доходность (%), макс. лет до погашения, макс. дюрация,
+# сколько лучших по доходности оставить (0 — без ограничения)
+SCREEN = {"min_yield": 0, "max_years": 0, "max_duration": 0, "top_k": 0}
+# асинхронный режим: сколько запросов купонов держать в полёте одновременно
+ASYNC_CONCURRENCY = 8
+# процессов для разбора страниц isin.ru/АКРА и выгрузок НРА/НКР (0 — разбирать в том же потоке)
+PARSE_WORKERS = 2
+# Тинькофф: пределы скорости (запросов/с на метод) и её прирост за секунду без ошибок
+TINKOFF_MIN_RATE = 0.5
+TINKOFF_MAX_RATE = 100
+TINKOFF_RAMP = 0.2
 
 FILENAME_FOR_NRA_OUTPUT = "NRA_ratings.xlsx"
 FILENAME_FOR_NKR_OUTPUT = "NKR_ratings.xlsx"
+FILENAME_FOR_ACRA_OUTPUT = "ACRA_ratings.json"
+
+# локальный кэш между запусками (купоны, ИНН)
+CACHE_DB = "bonds_cache.sqlite"
+USE_CACHE = True
+COUPON_CACHE_TTL_DAYS = 7
+ITN_CACHE_TTL_DAYS = 90
+ITN_NEGATIVE_TTL_DAYS = 7
+# снимок статических данных последнего полного запуска для --reprice
+SNAPSHOT_FILE = "bonds_snapshot.npz"
+# журнал идущего сбора для --resume ("" — не вести)
+JOURNAL_FILE = "bonds_journal.jsonl"
+# история: каждый запуск дописывается сюда по датам ("" — не вести)
+HISTORY_DIR = "bonds_history"
+# потоковый режим: как часто публиковать таблицу (сек), куда ещё писать её в JSON ("" — никуда)
+# и сколько облигаций подписывать на один MarketDataStream
+STREAM_PUBLISH_SECONDS = 30
+STREAM_JSON = ""
+STREAM_SUBSCRIPTIONS = 300
+# --serve: адрес HTTP, как часто полный сбор и как часто пересчёт по снимку между ними (сек, 0 — не пересчитывать)
+SERVE_ADDRESS = "127.0.0.1:8765"
+SERVE_REFRESH_SECONDS = 3600
+SERVE_REPRICE_SECONDS = 300
+# метрики запуска ("" — не писать)
+METRICS_JSON = "bonds_metrics.json"
+METRICS_PROM = "bonds_metrics.prom"
 
 # ---- Клиент Tinkoff: один на всё исполнение ----
 _CLIENT_CTX = None  # сам контекст-менеджер (на нём вызываем __exit__)
 _CLIENT = None      # объект, возвращённый __enter__ (на нём есть .instruments, .market_data и т.п.)
 
+def refresh_clock() -> datetime:
+    global UTCNOW
+    UTCNOW = datetime.now(timezone.utc)
+    return UTCNOW
+
 def get_client():
+    """Синхронный клиент: открывается при первом обращении (№1), --engine async без --reprice/--stream его не открывает."""
     global _CLIENT_CTX, _CLIENT
     if _CLIENT is None:
+        from tinkoff.invest import Client
         _CLIENT_CTX = Client(TOKEN)      # создаём контекст-менеджер
         _CLIENT = _CLIENT_CTX.__enter__()  # входим и сохраняем возвращённый объект
     return _CLIENT
 
+def async_client():
+    """Контекст асинхронного клиента для --engine async (свой на каждый проход)."""
+    from tinkoff.invest import AsyncClient
+    return AsyncClient(TOKEN)
+
 def close_client():
     global _CLIENT_CTX, _CLIENT
     if _CLIENT_CTX is not None:
@@ -80,16 +209,436 @@ def close_client():
             _CLIENT_CTX = None
             _CLIENT = None
 
+# ---- Метрики: вызовы внешних источников, задержки, повторы, паузы, объём загрузок, кэши ----
+# В конце запуска пишутся в METRICS_JSON и METRICS_PROM (текстовый формат Prometheus).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metrics:
+    """Счётчики, показатели и гистограммы с метками; общие на все потоки."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (имя, метки) -> значение, только растёт
+        self.gauges = {}      # (имя, метки) -> текущее значение
+        self.histograms = {}  # (имя, метки) -> [число по корзинам LATENCY_BUCKETS..., сумма, количество]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for n, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist[n] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            gauges = [{"name": name, "labels": dict(labels), "value": value}
+                      for (name, labels), value in sorted(self.gauges.items())]
+            histograms = [{"name": name, "labels": dict(labels),
+                           "buckets": dict(zip(map(str, LATENCY_BUCKETS), hist[:-2])),
+                           "sum": hist[-2], "count": hist[-1]}
+                          for (name, labels), hist in sorted(self.histograms.items())]
+        return {"generated_at": datetime.now(timezone.utc).isoformat(),
+                "counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def prometheus(self) -> str:
+        def fmt(labels, **extra):
+            pairs = [*labels, *extra.items()]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                for (name, labels), value in sorted(values.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(LATENCY_BUCKETS, hist):
+                    lines.append(f"{name}_bucket{fmt(labels, le=bound)} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, le='+Inf')} {hist[-1]}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist[-2]}")
+                lines.append(f"{name}_count{fmt(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def grpc_code(err):
+    """StatusCode ошибки gRPC или None. SDK Тинькофф заворачивает RpcError в RequestError/AioRequestError,
+    у которых code — атрибут, а у самого grpc.RpcError — метод code()."""
+    code = getattr(err, "code", None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            return None
+    return code if isinstance(code, Enum) else None
+
+def error_code(err) -> str:
+    """Код gRPC (INTERNAL, RESOURCE_EXHAUSTED, ...) или имя класса исключения."""
+    code = grpc_code(err)
+    return code.name if code is not None else type(err).__name__
+
+def record_call(upstream, method, started, outcome):
+    METRICS.inc("bonds_upstream_calls_total", upstream=upstream, method=method, outcome=outcome)
+    METRICS.observe("bonds_upstream_latency_seconds", time.monotonic() - started, upstream=upstream, method=method)
+
+def record_failed_call(upstream, method, started, err, pause=None):
+    """Неудачный вызов; pause — пауза перед повтором, None — попытка была последней и повтора не будет."""
+    code = error_code(err)
+    record_call(upstream, method, started, code)
+    if pause is not None:
+        METRICS.inc("bonds_retries_total", upstream=upstream, method=method, code=code)
+        record_sleep("retry", pause, upstream)
+
+def record_sleep(reason, seconds, upstream=""):
+    METRICS.inc("bonds_sleep_seconds_total", seconds, reason=reason, upstream=upstream)
+
+def record_cache(cache, hit):
+    METRICS.inc("bonds_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def dump_metrics():
+    """Записывает метрики в METRICS_JSON и METRICS_PROM (пустое имя — не писать)."""
+    # промахи/попадания lru_cache по ИНН и рейтингам — из самих кэшей
+    for cache, fn in (("itn", get_company_itn), ("acra", get_acra_rating_by_isin),
+                      ("nra", get_NRA_rating_by_itn), ("nkr", get_NKR_rating_by_itn)):
+        info = fn.cache_info() if hasattr(fn, "cache_info") else None
+        if info is None:
+            continue
+        METRICS.set("bonds_memo_requests", info.hits, cache=cache, result="hit")
+        METRICS.set("bonds_memo_requests", info.misses, cache=cache, result="miss")
+
+    for path, render in ((METRICS_JSON, lambda: json.dumps(METRICS.as_dict(), ensure_ascii=False, indent=1)),
+                         (METRICS_PROM, METRICS.prometheus)):
+        if not path:
+            continue
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+
+# ---- Ограничение частоты запросов к внешним источникам ----
+class RateLimiter:
+    """Не чаще rate запросов в секунду; общий на все потоки."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Ждёт своей очереди; возвращает, сколько секунд проспал."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0.0
+
+# пусто, пока не включены ограничения (collect_bonds включает их для всех режимов)
+_RATE_LIMITERS = {}
+
+def enable_rate_limits():
+    for upstream, rate in RATE_LIMITS.items():
+        # у Тинькофф свои ограничители по методам, см. ниже
+        if upstream != "tinkoff" and upstream not in _RATE_LIMITERS:
+            _RATE_LIMITERS[upstream] = RateLimiter(rate)
+
+def rate_limit(upstream: str):
+    limiter = _RATE_LIMITERS.get(upstream)
+    if limiter is not None:
+        waited = limiter.acquire()
+        if waited:
+            record_sleep("rate_limit", waited, upstream)
+
+# ---- Тинькофф: свой token bucket на каждый метод, скорость подстраивается под квоту ----
+# Начинаем с RATE_LIMITS["tinkoff"] запросов в секунду. RESOURCE_EXHAUSTED или исчерпанная квота
+# в метаданных ответа (x-ratelimit-remaining / x-ratelimit-reset) — скорость вдвое ниже, и все
+# потоки ждут сброса окна. Пока ошибок нет, скорость растёт на TINKOFF_RAMP * 100% в секунду, а у 90%
+# скорости последнего отказа — медленно, на TINKOFF_RAMP запросов/с каждую секунду.
+class AdaptiveLimiter:
+    def __init__(self, rate: float):
+        self.rate = min(max(rate, TINKOFF_MIN_RATE), TINKOFF_MAX_RATE)
+        self.burst = max(1.0, self.rate)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self.ceiling = float("inf")  # скорость, на которой последний раз упёрлись в квоту
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Забирает токен (в долг, если их нет); возвращает, сколько надо подождать перед запросом."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate, self._blocked_until - now)
+
+    def on_success(self):
+        with self._lock:
+            # далеко от известного потолка: +TINKOFF_RAMP на запрос, т.е. на TINKOFF_RAMP * 100% в секунду;
+            # рядом с ним +TINKOFF_RAMP/rate на запрос — при rate запросах в секунду это +TINKOFF_RAMP за секунду
+            step = TINKOFF_RAMP if self.rate < 0.9 * self.ceiling else TINKOFF_RAMP / self.rate
+            self.rate = min(TINKOFF_MAX_RATE, self.rate + step)
+            self.burst = max(1.0, self.rate)
+
+    def on_quota(self, remaining, reset, exhausted=False):
+        """Обратная связь от API: exhausted — пришёл RESOURCE_EXHAUSTED; remaining/reset — из метаданных."""
+        with self._lock:
+            now = time.monotonic()
+            if exhausted or remaining == 0:
+                # отказы запросов, ушедших до первого, — тот же перебор, снижаем скорость один раз
+                if now >= self._blocked_until:
+                    self.ceiling = self.rate
+                    self.rate = max(TINKOFF_MIN_RATE, self.rate / 2)
+                self.tokens = min(self.tokens, 0.0)
+                self._blocked_until = max(self._blocked_until, now + (reset if reset else 1.0 / self.rate))
+            elif remaining is not None and reset:
+                # не тратить быстрее, чем позволяет остаток окна
+                self.rate = max(TINKOFF_MIN_RATE, min(self.rate, remaining / reset))
+            self.burst = max(1.0, self.rate)
+
+_TINKOFF_LIMITERS = {}
+_TINKOFF_LIMITERS_LOCK = threading.Lock()
+
+def tinkoff_limiter(method: str):
+    """Ограничитель метода или None, если RATE_LIMITS["tinkoff"] = 0 (без ограничения)."""
+    if not RATE_LIMITS.get("tinkoff"):
+        return None
+    with _TINKOFF_LIMITERS_LOCK:
+        limiter = _TINKOFF_LIMITERS.get(method)
+        if limiter is None:
+            limiter = _TINKOFF_LIMITERS[method] = AdaptiveLimiter(RATE_LIMITS["tinkoff"])
+    return limiter
+
+def ratelimit_metadata(err):
+    """(remaining, reset) из ответа с ошибкой: metadata исключения SDK или заголовки gRPC; None — нет данных."""
+    meta = getattr(err, "metadata", None)
+    remaining = getattr(meta, "ratelimit_remaining", None)
+    reset = getattr(meta, "ratelimit_reset", None)
+    if remaining is None and reset is None and hasattr(err, "trailing_metadata"):
+        try:
+            pairs = dict(err.trailing_metadata() or ()) | dict(err.initial_metadata() or ())
+        except Exception:
+            pairs = {}
+        remaining, reset = pairs.get("x-ratelimit-remaining"), pairs.get("x-ratelimit-reset")
+    try:
+        return (int(remaining) if remaining is not None else None,
+                float(reset) if reset is not None else None)
+    except (TypeError, ValueError):
+        return None, None
+
+def tinkoff_wait(method: str) -> float:
+    """Сколько ждать перед вызовом метода (уже учтено в метриках как пауза rate_limit)."""
+    limiter = tinkoff_limiter(method)
+    wait = limiter.reserve() if limiter is not None else 0.0
+    if wait:
+        record_sleep("rate_limit", wait, "tinkoff")
+    return wait
+
+def tinkoff_feedback(method: str, err=None):
+    limiter = tinkoff_limiter(method)
+    if limiter is None:
+        return
+    if err is None:
+        limiter.on_success()
+        return
+    remaining, reset = ratelimit_metadata(err)
+    exhausted = error_code(err) == "RESOURCE_EXHAUSTED"
+    if exhausted or remaining is not None:
+        limiter.on_quota(remaining, reset, exhausted)
+
+# ---- HTTP: одна сессия с пулом keep-alive соединений на каждый хост ----
+# имя источника для RATE_LIMITS по хосту
+UPSTREAM_HOSTS = {
+    "www.isin.ru": "isin.ru",
+    "www.acra-ratings.ru": "acra",
+    "www.ra-national.ru": "nra",
+    "ratings.ru": "nkr",
+}
+
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+def http_session(host: str) -> "requests.Session":
+    from requests.adapters import HTTPAdapter
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(host)
+        if session is None:
+            if not _HTTP_SESSIONS:
+                requests.packages.urllib3.disable_warnings()  # (№7 verify=True не внедряем; таймауты — в HTTP_TIMEOUTS)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _HTTP_SESSIONS[host] = session
+    return session
+
+def http_request(method: str, url: str, **kwargs) -> "requests.Response":
+    host = urlsplit(url).hostname
+    kwargs.setdefault("timeout", HTTP_TIMEOUTS.get(host, HTTP_TIMEOUTS.get("default")))
+    upstream = UPSTREAM_HOSTS.get(host, host)
+    rate_limit(upstream)
+    started = time.monotonic()
+    try:
+        r = http_session(host).request(method, url, **kwargs)
+    except Exception as e:
+        record_call(upstream, method, started, error_code(e))
+        raise
+    # для stream=True это время до заголовков; тело и его объём учитывает ensure_daily_file
+    record_call(upstream, method, started, f"{r.status_code // 100}xx")
+    if not kwargs.get("stream"):
+        METRICS.inc("bonds_downloaded_bytes_total", len(r.content), upstream=upstream)
+    return r
+
+def close_http_sessions():
+    with _HTTP_SESSIONS_LOCK:
+        for session in _HTTP_SESSIONS.values():
+            session.close()
+        _HTTP_SESSIONS.clear()
+
+# ---- Разбор ответов в пуле процессов ----
+# Сеть остаётся в потоках, а декодирование и разбор тела (CPU, держит GIL) уходят в PARSE_WORKERS
+# процессов. Время разбора пишется в bonds_parse_seconds, отдельно от сетевого
+# bonds_upstream_latency_seconds. Парсеры — функции модуля от текста ответа: их передаём по имени.
+# Небольшой ответ с известной кодировкой быстрее разобрать на месте, чем гонять в другой процесс.
+PARSE_INLINE_BYTES = 16 * 1024
+_PARSE_POOL = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+def response_text(content: bytes, encoding) -> str:
+    """То же, что Response.text у requests, но по байтам тела и кодировке из заголовков."""
+    if encoding is None:
+        from requests.compat import chardet
+        encoding = chardet.detect(content)["encoding"] if chardet is not None else None
+    try:
+        return str(content, encoding or "utf-8", errors="replace")
+    except (LookupError, TypeError):
+        return str(content, errors="replace")
+
+def _run_parser(parser, args, body):
+    started = time.perf_counter()
+    if body is not None:
+        args = (response_text(*body), *args)
+    return parser(*args), time.perf_counter() - started
+
+def parse_pool():
+    global _PARSE_POOL
+    if PARSE_WORKERS <= 0:
+        return None
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn, а не fork: к этому моменту в процессе уже работают потоки конвейера
+            _PARSE_POOL = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _PARSE_POOL
+
+def parse(parser, *args, response=None):
+    """parser(текст response, *args) или, без response, parser(*args) — в пуле процессов разбора."""
+    from concurrent.futures.process import BrokenProcessPool
+    global _PARSE_POOL
+    body = (response.content, response.encoding) if response is not None else None
+    inline = body is not None and body[1] is not None and len(body[0]) < PARSE_INLINE_BYTES
+    pool = None if inline else parse_pool()
+    try:
+        if pool is None:
+            result, elapsed = _run_parser(parser, args, body)
+        else:
+            result, elapsed = pool.submit(_run_parser, parser, args, body).result()
+    except BrokenProcessPool as e:
+        # процесс разбора упал — этот ответ разбираем здесь, пул пересоздастся при следующем вызове
+        logging.warning("Parse pool is broken (%s), parsing %s in-process", e, parser.__name__)
+        with _PARSE_POOL_LOCK:
+            if _PARSE_POOL is pool:
+                _PARSE_POOL = None
+        result, elapsed = _run_parser(parser, args, body)
+    METRICS.observe("bonds_parse_seconds", elapsed, parser=parser.__name__)
+    return result
+
+def close_parse_pool():
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is not None:
+            _PARSE_POOL.shutdown(cancel_futures=True)
+            _PARSE_POOL = None
+
 # ---- Ретраи с экспоненциальным backoff (№2) ----
-def call_with_retry(fn, *args, retries=3, delay=0.5, **kwargs):
+def call_with_retry(fn, *args, retries=3, delay=0.5, upstream="tinkoff", method=None, **kwargs):
+    method = method or getattr(fn, "__name__", "call")
     last_err = None
     for i in range(retries):
+        if upstream == "tinkoff":
+            time.sleep(tinkoff_wait(method))
+        started = time.monotonic()
         try:
-            return fn(*args, **kwargs)
+            result = fn(*args, **kwargs)
         except Exception as e:
             last_err = e
-            logging.warning("Retry %d/%d for %s: %s", i + 1, retries, getattr(fn, "__name__", "call"), e)
+            logging.warning("Retry %d/%d for %s: %s", i + 1, retries, method, e)
+            if upstream == "tinkoff":
+                tinkoff_feedback(method, e)
+            if i == retries - 1:
+                record_failed_call(upstream, method, started, e)
+                break
+            record_failed_call(upstream, method, started, e, delay * (2 ** i))
             time.sleep(delay * (2 ** i))
+        else:
+            if upstream == "tinkoff":
+                tinkoff_feedback(method)
+            record_call(upstream, method, started, "OK")
+            return result
+    raise last_err
+
+async def async_call_with_retry(fn, *args, retries=3, delay=0.5, upstream="tinkoff", method=None, **kwargs):
+    method = method or getattr(fn, "__name__", "call")
+    last_err = None
+    for i in range(retries):
+        if upstream == "tinkoff":
+            await asyncio.sleep(tinkoff_wait(method))
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            last_err = e
+            logging.warning("Retry %d/%d for %s: %s", i + 1, retries, method, e)
+            if upstream == "tinkoff":
+                tinkoff_feedback(method, e)
+            if i == retries - 1:
+                record_failed_call(upstream, method, started, e)
+                break
+            record_failed_call(upstream, method, started, e, delay * (2 ** i))
+            await asyncio.sleep(delay * (2 ** i))
+        else:
+            if upstream == "tinkoff":
+                tinkoff_feedback(method)
+            record_call(upstream, method, started, "OK")
+            return result
     raise last_err
 
 # ---- Перевод сектора (как было) ----
@@ -112,8 +661,20 @@ def translate_sector(sector_en):
     return mapping.get(sector_en, sector_en)
 
 # ---- Кэш рейтингов и ИНН (№8) ----
+ISIN_RU_URL = "https://www.isin.ru/ru/ru_isin/db/"
+
 @lru_cache(maxsize=5000)
 def get_company_itn(isin: str) -> str:
+    # сначала постоянный кэш: isin.ru стоит двух запросов на каждый ISIN
+    itn = load_cached_itn(isin)
+    if USE_CACHE:
+        record_cache("itn_db", itn is not None)
+    if itn is None:
+        itn = fetch_company_itn(isin)
+        store_itn(isin, itn)
+    return itn
+
+def fetch_company_itn(isin: str) -> str:
     data_for_get_itn = {
         "from_code": "isin",
         "input_from_isin": isin,
@@ -122,103 +683,528 @@ def get_company_itn(isin: str) -> str:
         "search": 1,
     }
     try:
-        r = requests.post("https://www.isin.ru/ru/ru_isin/db/", data=data_for_get_itn, verify=False)
+        r = http_request("POST", ISIN_RU_URL, data=data_for_get_itn, verify=False)
     except Exception as e:
         raise ValueError("get_company_itn::" + str(e))
 
-    if r.text.find("index.php?type=issue_id") == -1:
+    company_link = parse(parse_isin_search, response=r)
+    if not company_link:
         return ""
-    company_url = "https://www.isin.ru/ru/ru_isin/db/" + r.text[r.text.find("index.php?type=issue_id"):].split("\"")[0]
 
     try:
-        r = requests.get(company_url, verify=False)
+        r = http_request("GET", ISIN_RU_URL + company_link, verify=False)
     except Exception as e:
         raise ValueError("get_company_itn::" + str(e))
 
-    if r.text.find("ИНН") == -1:
+    return parse(parse_isin_company, response=r)
+
+def parse_isin_search(html: str) -> str:
+    """Ссылка на карточку эмитента из результатов поиска isin.ru или "", если выпуск не найден."""
+    start = html.find("index.php?type=issue_id")
+    if start == -1:
+        return ""
+    return html[start:].split("\"")[0]
+
+def parse_isin_company(html: str) -> str:
+    """ИНН с карточки эмитента isin.ru или ""."""
+    start = html.find("ИНН")
+    if start == -1:
         return ""
     try:
-        return str(int(r.text[r.text.find("ИНН") + 16:].split("<")[0]))
+        return str(int(html[start + 16:].split("<")[0]))
     except Exception:
         return ""
 
+# ---- ИНН один раз на эмитента ----
+# У крупных эмитентов десятки выпусков, а ИНН у них общий, и рейтинги НРА/НКР ищутся по ИНН.
+# Эмитент выпуска — заёмщик (юрлицо) из актива Тинькофф: get_asset_by(asset_uid).security.bond.borrow_name,
+# он хранится в CACHE_DB. Бренд для этого не годится: под одним брендом бывают юрлица с разными ИНН.
+# До стадии рейтингов выпуски каждого эмитента в порядке выборки идут на isin.ru, пока по одному
+# из них не найдётся ИНН, и этот ИНН получают все выпуски эмитента — при любом движке одинаково.
+# Выпуски без эмитента ищутся по своему ISIN. Рейтинг АКРА остаётся по ISIN: он у каждого выпуска свой.
+def issuer_rows(table) -> list:
+    """Номера облигаций, которым ещё нужен ИНН (госы и облигации без купонов не ищем,
+    восстановленные из журнала уже с ИНН)."""
+    return [i for i in range(len(table))
+            if table.sector[i] != "government" and table.itn[i] is None and not table.failed[i]]
+
+def borrower_name(asset) -> str:
+    """Заёмщик из ответа get_asset_by или "", если актив не облигация или поля нет."""
+    bond = getattr(getattr(asset, "security", None), "bond", None)
+    return (getattr(bond, "borrow_name", "") or "").strip()
+
+def _issuers_from_cache(client, table, rows) -> list:
+    """Эмитенты из кэша — сразу в таблицу; возвращает номера, по которым надо спросить Тинькофф."""
+    if not hasattr(client.instruments, "get_asset_by"):
+        logging.info("Asset lookups are not available, resolving ITN per issue")
+        return []
+    todo = []
+    for i in rows:
+        # параллельно с купонами облигация могла уже получить ошибку — на неё запросы не тратим
+        if not table.asset_uid[i] or table.issuer[i] or table.failed[i]:
+            continue
+        issuer = load_cached_issuer(table.asset_uid[i])
+        if USE_CACHE:
+            record_cache("issuer_db", issuer is not None)
+        if issuer is None:
+            todo.append(i)
+        else:
+            table.issuer[i] = issuer
+    return todo
+
+def load_issuers(client, table, rows):
+    for i in _issuers_from_cache(client, table, rows):
+        if table.failed[i]:
+            continue
+        uid = table.asset_uid[i]
+        try:
+            asset = call_with_retry(client.instruments.get_asset_by, id=uid, method="get_asset_by").asset
+        except Exception as e:
+            logging.warning("Asset error for %s: %s", table.isin[i], e)
+            continue
+        table.issuer[i] = borrower_name(asset)
+        store_issuer(uid, table.issuer[i])
+        journal_issuer(table, i)
+
+async def load_issuers_async(client, table, rows):
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+
+    async def load(i):
+        uid = table.asset_uid[i]
+        try:
+            async with semaphore:
+                if table.failed[i]:
+                    return
+                asset = (await async_call_with_retry(client.instruments.get_asset_by, id=uid,
+                                                     method="get_asset_by")).asset
+        except Exception as e:
+            logging.warning("Asset error for %s: %s", table.isin[i], e)
+            return
+        table.issuer[i] = borrower_name(asset)
+        store_issuer(uid, table.issuer[i])
+        journal_issuer(table, i)
+
+    await asyncio.gather(*(load(i) for i in _issuers_from_cache(client, table, rows)))
+
+def issuer_groups(table, rows) -> list:
+    """Номера облигаций по эмитентам, в порядке выборки; выпуск без эмитента — сам себе группа."""
+    groups = {}
+    for i in rows:
+        groups.setdefault(table.issuer[i] or "isin:" + table.isin[i], []).append(i)
+    logging.info("%d bonds need ITN, %d issuers", len(rows), len(groups))
+    return list(groups.values())
+
+def resolve_issuer(table, rows, known=""):
+    """ИНН эмитента по его выпускам rows по порядку — первый найденный достаётся всем.
+    known — ИНН, уже найденный по другим выпускам эмитента (журнал, снимок): тогда isin.ru не нужен."""
+    if known:
+        METRICS.inc("bonds_issuer_itn_shared_total", len(rows))
+        for i in rows:
+            table.itn[i] = known
+            journal_itn(table, i)
+        return
+    itn, failed = "", []
+    for n, i in enumerate(rows):
+        if table.failed[i]:
+            continue
+        try:
+            itn = get_company_itn(table.isin[i])
+        except Exception as e:
+            logging.warning("ITN error for %s: %s", table.isin[i], e)
+            failed.append(i)
+            continue
+        if itn:
+            METRICS.inc("bonds_issuer_itn_shared_total", len(rows) - n - 1)
+            break
+    for i in rows:
+        table.itn[i] = itn
+        # пустой ИНН после ошибки запроса не записываем: --resume спросит isin.ru снова
+        if itn or i not in failed:
+            journal_itn(table, i)
+    if not itn:
+        for i in failed:
+            table.nra[i] = "Ошибка запроса ИНН"
+            table.nkr[i] = "Ошибка запроса ИНН"
+
+def resolve_issuer_itns(table, groups, workers=1):
+    """ИНН всех групп: эмитенты — параллельно в workers потоках, выпуски одного эмитента — по порядку."""
+    known = {table.issuer[i]: table.itn[i] for i in range(len(table)) if table.issuer[i] and table.itn[i]}
+    work = queue.Queue()
+    for rows in groups:
+        work.put(rows)
+
+    def worker():
+        while True:
+            try:
+                rows = work.get_nowait()
+            except queue.Empty:
+                return
+            resolve_issuer(table, rows, known.get(table.issuer[rows[0]], ""))
+
+    threads = [threading.Thread(target=worker, name=f"itn-{n}", daemon=True) for n in range(max(1, workers))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def resolve_issuers(client, table, workers=1, rows=None):
+    rows = issuer_rows(table) if rows is None else rows
+    load_issuers(client, table, rows)
+    resolve_issuer_itns(table, issuer_groups(table, rows), workers)
+
+async def resolve_issuers_async(client, table):
+    rows = issuer_rows(table)
+    await load_issuers_async(client, table, rows)
+    await asyncio.to_thread(resolve_issuer_itns, table, issuer_groups(table, rows), PIPELINE_WORKERS.get("itn", 1))
+
+# ---- АКРА: общий индекс ISIN -> рейтинг, собирается раз в день по списку выпусков ----
+# Вместо поиска по сайту и разбора страницы выпуска на каждую облигацию листаем перечень
+# рейтингов выпусков и складываем в FILENAME_FOR_ACRA_OUTPUT. Страницы разбираются
+# регулярными выражениями — полный DOM не строим.
+ACRA_ISSUES_URL = "https://www.acra-ratings.ru/ratings/issues/"
+ACRA_MAX_PAGES = 300
+
+_ISIN_RE = re.compile(r"\bRU[0-9A-Z]{9}[0-9]\b")
+_ACRA_RATING_RE = re.compile(r"(?<![A-Za-z])(?:AAA|AA[+-]?|A[+-]?|BBB[+-]?|BB[+-]?|B[+-]?|CCC|CC|C|RD|SD|D)\(RU(?:\.sf)?\)")
+_ACRA_BLOCK_RE = re.compile(r"<tr\b|<li\b|class=\"[^\"]*(?:item|row)\b")
+_TAG_RE = re.compile(r"<[^>]+>")
+
+_ACRA_INDEX = None
+_ACRA_INDEX_LOCK = threading.Lock()
+
+def parse_acra_issues_page(html: str) -> dict:
+    """ISIN -> рейтинг со страницы перечня: в каждой строке/карточке ищем ISIN и рейтинг."""
+    ratings = {}
+    for block in _ACRA_BLOCK_RE.split(html):
+        isins = _ISIN_RE.findall(block)
+        if not isins:
+            continue
+        found = _ACRA_RATING_RE.search(_TAG_RE.sub(" ", block))
+        if not found:
+            continue
+        for isin in isins:
+            ratings.setdefault(isin, found.group(0))
+    return ratings
+
+def build_acra_index() -> dict:
+    index = {}
+    for page in range(1, ACRA_MAX_PAGES + 1):
+        r = http_request("GET", ACRA_ISSUES_URL, params={"page": page}, verify=False,
+                         headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
+        if r.status_code == 404:
+            break
+        if r.status_code != 200:
+            raise ValueError("build_acra_index::Ошибка: " + str(r.status_code))
+        page_ratings = parse(parse_acra_issues_page, response=r)
+        # пустая страница или повтор последней — перечень закончился
+        if not page_ratings or page_ratings.keys() <= index.keys():
+            break
+        for isin, rating in page_ratings.items():
+            index.setdefault(isin, rating)
+        # АКРА не любит частых запросов (см. «Нюансы» в Readme)
+        record_sleep("api_delay", API_DELAY, "acra")
+        time.sleep(API_DELAY)
+    return index
+
+def acra_index() -> dict:
+    global _ACRA_INDEX
+    today = datetime.now().date()
+    with _ACRA_INDEX_LOCK:
+        if _ACRA_INDEX is not None and _ACRA_INDEX[0] == today:
+            return _ACRA_INDEX[1]
+        index = None
+        try:
+            with open(FILENAME_FOR_ACRA_OUTPUT, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("date") == today.isoformat():
+                index = saved["ratings"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if index is None:
+            try:
+                index = build_acra_index()
+            except Exception as e:
+                # не повторяем обход на каждой облигации: до конца дня считаем рейтинги АКРА неизвестными
+                logging.warning("ACRA index build failed: %s", e)
+                index = {}
+            if index:
+                tmp_path = FILENAME_FOR_ACRA_OUTPUT + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"date": today.isoformat(), "ratings": index}, f, ensure_ascii=False)
+                os.replace(tmp_path, FILENAME_FOR_ACRA_OUTPUT)
+
+        _ACRA_INDEX = (today, index)
+        return index
+
 @lru_cache(maxsize=5000)
 def get_acra_rating_by_isin(isin: str) -> str:
-    # try:
-    #     r = requests.get("https://www.acra-ratings.ru/search/?q=" + isin, verify=False,
-    #                      headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
-    # except Exception as e:
-    #     raise ValueError("get_acra_rating_by_isin::" + str(e))
-    # if r.status_code != 200:
-    #     raise ValueError("get_acra_rating_by_isin::Ошибка запроса: " + str(r.status_code))
-
-    # try:
-    #     parsed_html = BeautifulSoup(r.text, "lxml")
-    #     # на странице выдачи ищем карточки
-    #     search_items = parsed_html.body.find_all('div', attrs={'class': "search-result__item"})
-    #     for item in search_items:
-    #         try:
-    #             tag_text = item.find('div', attrs={'class': "tag"}).text.replace(" ", "")
-    #             if "Выпуск" in tag_text:
-    #                 href = item.find('a', attrs={'class': "search-result__item-text"})['href']
-    #                 return acra_get_rating_by_url(href)
-    #         except Exception:
-    #             continue
-    # except Exception as e:
-    #     raise ValueError("get_acra_rating_by_isin::" + str(e))
-    return "Не оценен"
-
-def acra_get_rating_by_url(url: str) -> str:
-    request_url = "https://www.acra-ratings.ru" + url
-    r = requests.get(request_url, verify=False,
-                     headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
-    if r.status_code != 200:
-        raise ValueError("acra_get_rating_by_url::Ошибка: " + str(r.status_code))
-    parsed_html = BeautifulSoup(r.text, "lxml")
-    widget = parsed_html.body.find('div', attrs={'class': "rating-widget"})
-    return widget.text.replace(" ", "").replace("\n", "") if widget else "Не оценен"
+    return acra_index().get(isin, "Не оценен")
+
+_DAILY_FILE_LOCK = threading.Lock()
+
+def _read_download_meta(path: str) -> dict:
+    try:
+        with open(path + ".meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_download_meta(path: str, meta: dict):
+    tmp_path = path + ".meta.json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path + ".meta.json")
 
 def ensure_daily_file(path: str, url: str, headers=None):
-    """Грубо: если файла нет или он создан/изменён не сегодня — скачать заново."""
-    if not os.path.exists(path) or datetime.fromtimestamp(os.path.getmtime(path)).date() != datetime.now().date():
-        r = requests.get(url, headers=headers or {})
-        open(path, 'wb').write(r.content)
+    """Раз в день проверяет файл на сервере: условный запрос, при изменении — скачивание во временный файл и замена."""
+    # в конвейере сюда приходят несколько потоков сразу — качаем один раз
+    with _DAILY_FILE_LOCK:
+        exists = os.path.exists(path)
+        meta = _read_download_meta(path) if exists else {}
+        if exists:
+            checked_at = meta.get("checked_at")
+            checked = (datetime.fromisoformat(checked_at) if checked_at
+                       else datetime.fromtimestamp(os.path.getmtime(path)))
+            if checked.date() == datetime.now().date():
+                return
+
+        request_headers = dict(headers or {})
+        if exists and meta.get("etag"):
+            request_headers["If-None-Match"] = meta["etag"]
+        if exists and meta.get("last_modified"):
+            request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        started = time.monotonic()
+        with http_request("GET", url, headers=request_headers, stream=True) as r:
+            if r.status_code == 304 and exists:
+                meta["checked_at"] = datetime.now().isoformat()
+                _write_download_meta(path, meta)
+                logging.info("%s not modified", url)
+                return
+            if r.status_code != 200:
+                if exists:
+                    # вчерашний файл лучше, чем ничего
+                    logging.warning("Download of %s failed with %s, keeping %s", url, r.status_code, path)
+                    return
+                raise ValueError("ensure_daily_file::Ошибка запроса: " + str(r.status_code))
+
+            # пишем во временный файл рядом и подменяем целиком: оборванная загрузка не испортит старый файл
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                            prefix=os.path.basename(path) + ".", suffix=".part")
+            size = 0
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+        elapsed = time.monotonic() - started
+        host = urlsplit(url).hostname
+        METRICS.inc("bonds_downloaded_bytes_total", size, upstream=UPSTREAM_HOSTS.get(host, host))
+        now = datetime.now().isoformat()
+        _write_download_meta(path, {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "checked_at": now,
+            "downloaded_at": now,
+            "size": size,
+            "seconds": round(elapsed, 3),
+        })
+        logging.info("Downloaded %s: %d bytes in %.2f s", url, size, elapsed)
+
+# ---- Индексы рейтингов НРА/НКР: ИНН -> рейтинг ----
+# Выгрузка агентства разбирается один раз в день, готовый словарь кладётся рядом с xlsx
+# (<файл>.index.json) и при следующих запусках читается без pandas.
+NRA_RATINGS_URL = "https://www.ra-national.ru/wp-load.php?security_key=100c906f36a0b90e&export_id=20&action=get_data"
+NKR_RATINGS_URL = "https://ratings.ru/issuers.php"
+
+_RATING_INDEXES = {}
+_RATING_INDEX_LOCK = threading.Lock()
+
+def normalize_itn(value) -> str:
+    """ИНН к одному виду: только цифры, без ведущих нулей (как возвращает get_company_itn)."""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value.is_integer():
+            value = int(value)
+    return "".join(ch for ch in str(value) if ch.isdigit()).lstrip("0")
+
+def build_rating_index(path: str, itn_column: str, rating_column: str) -> dict:
+    df = pd.read_excel(path)
+    if itn_column not in df.columns or rating_column not in df.columns:
+        return {}
+    index = {}
+    for itn, rating in zip(df[itn_column].tolist(), df[rating_column].tolist()):
+        key = normalize_itn(itn)
+        # как раньше при поиске — берётся первая строка с этим ИНН
+        if key and key not in index:
+            index[key] = rating if isinstance(rating, str) or not pd.isna(rating) else None
+    return index
+
+def rating_index(name: str, path: str, url: str, itn_column: str, rating_column: str, headers=None) -> dict:
+    today = datetime.now().date()
+    with _RATING_INDEX_LOCK:
+        cached = _RATING_INDEXES.get(name)
+        if cached is not None and cached[0] == today:
+            return cached[1]
+
+        ensure_daily_file(path, url, headers=headers)
+        stat = os.stat(path)
+        source = [stat.st_mtime_ns, stat.st_size]
+        index_path = path + ".index.json"
+        index = None
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("source") == source:
+                index = saved["ratings"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if index is None:
+            index = parse(build_rating_index, path, itn_column, rating_column)
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"source": source, "ratings": index}, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, index_path)
+
+        _RATING_INDEXES[name] = (today, index)
+        return index
 
 @lru_cache(maxsize=5000)
 def get_NRA_rating_by_itn(itn: str) -> str:
-    ensure_daily_file(
+    index = rating_index(
+        "nra",
         FILENAME_FOR_NRA_OUTPUT,
-        "https://www.ra-national.ru/wp-load.php?security_key=100c906f36a0b90e&export_id=20&action=get_data",
-        headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
+        NRA_RATINGS_URL,
+        "ИНН", "Рейтинг",
+        headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"},
     )
-    df = pd.read_excel(FILENAME_FOR_NRA_OUTPUT)
-    if "ИНН" not in df.columns or "Рейтинг" not in df.columns:
-        return "Не оценен"
-    rows = df[df["ИНН"].astype(str) == str(itn)]
-    if rows.empty:
-        return "Не оценен"
-    try:
-        return rows.iloc[0]["Рейтинг"]
-    except Exception:
-        return "Не оценен"
+    return index.get(normalize_itn(itn), "Не оценен")
 
 @lru_cache(maxsize=5000)
 def get_NKR_rating_by_itn(itn: str) -> str:
-    ensure_daily_file(
-        FILENAME_FOR_NKR_OUTPUT,
-        "https://ratings.ru/issuers.php"
-    )
-    df = pd.read_excel(FILENAME_FOR_NKR_OUTPUT)
     # ожидаемые колонки "TIN" / "Rating"
-    if "TIN" not in df.columns or "Rating" not in df.columns:
-        return "Не оценен"
-    rows = df[df["TIN"].astype(str) == str(itn)]
-    if rows.empty:
-        return "Не оценен"
-    try:
-        return rows.iloc[0]["Rating"]
-    except Exception:
-        return "Не оценен"
+    index = rating_index("nkr", FILENAME_FOR_NKR_OUTPUT, NKR_RATINGS_URL, "TIN", "Rating")
+    return index.get(normalize_itn(itn), "Не оценен")
+
+# ---- Локальный кэш купонов (SQLite, ключ — figi) ----
+# Хранится расписание целиком и момент загрузки. Перезапрашиваем только то, что могло измениться:
+# флоатеры, устаревшие записи и облигации, у которых с прошлой загрузки прошла дата купона.
+_CACHE_CONN = None
+_CACHE_LOCK = threading.Lock()
+
+def cache_db():
+    global _CACHE_CONN
+    if _CACHE_CONN is None:
+        conn = sqlite3.connect(CACHE_DB, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS coupons ("
+            "figi TEXT PRIMARY KEY, fetched_at TEXT NOT NULL, fetched_to TEXT NOT NULL, events TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS itn (isin TEXT PRIMARY KEY, itn TEXT NOT NULL, fetched_at TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS issuer (asset_uid TEXT PRIMARY KEY, issuer TEXT NOT NULL, fetched_at TEXT NOT NULL)"
+        )
+        conn.commit()
+        _CACHE_CONN = conn
+    return _CACHE_CONN
+
+def load_cached_coupons(figi, floating, maturity_date, date_from, date_to):
+    """Купоны из кэша или None, если их надо запросить заново."""
+    if not USE_CACHE or floating:
+        return None
+    with _CACHE_LOCK:
+        row = cache_db().execute(
+            "SELECT fetched_at, fetched_to, events FROM coupons WHERE figi = ?", (figi,)
+        ).fetchone()
+    if row is None:
+        return None
+
+    fetched_at = datetime.fromisoformat(row[0])
+    if date_from - fetched_at > timedelta(days=COUPON_CACHE_TTL_DAYS):
+        return None
+    # горизонт запроса считается от текущего момента; после погашения купонов всё равно нет
+    needed_to = min(date_to, maturity_date + timedelta(days=7))
+    if needed_to > datetime.fromisoformat(row[1]):
+        return None
+    events = [(datetime.fromisoformat(d), units, nano) for d, units, nano in json.loads(row[2])]
+    # прошла дата купона — следующий мог быть объявлен/изменён
+    if any(fetched_at < d <= date_from for d, _, _ in events):
+        return None
+    return coupon_schedule([e for e in events if date_from <= e[0] <= date_to])
+
+def store_coupons(figi, floating, events, date_to):
+    if not USE_CACHE or floating:
+        return
+    events = json.dumps([[c.coupon_date.isoformat(), c.pay_one_bond.units, c.pay_one_bond.nano] for c in events])
+    with _CACHE_LOCK:
+        conn = cache_db()
+        conn.execute(
+            "INSERT OR REPLACE INTO coupons (figi, fetched_at, fetched_to, events) VALUES (?, ?, ?, ?)",
+            (figi, UTCNOW.isoformat(), date_to.isoformat(), events),
+        )
+        conn.commit()
+
+# ---- Постоянный кэш ISIN -> ИНН ----
+# Найденный ИНН живёт ITN_CACHE_TTL_DAYS, «ИНН не найден» (пустая строка) — ITN_NEGATIVE_TTL_DAYS.
+# Ошибки запроса не кэшируются. WAL позволяет нескольким процессам читать базу одновременно.
+def load_cached_itn(isin: str):
+    """ИНН из кэша ("" — известно, что ИНН нет) или None, если надо спросить isin.ru."""
+    if not USE_CACHE:
+        return None
+    with _CACHE_LOCK:
+        row = cache_db().execute("SELECT itn, fetched_at FROM itn WHERE isin = ?", (isin,)).fetchone()
+    if row is None:
+        return None
+    itn, fetched_at = row
+    ttl = ITN_CACHE_TTL_DAYS if itn else ITN_NEGATIVE_TTL_DAYS
+    if UTCNOW - datetime.fromisoformat(fetched_at) > timedelta(days=ttl):
+        return None
+    return itn
+
+def store_itn(isin: str, itn: str):
+    if not USE_CACHE:
+        return
+    with _CACHE_LOCK:
+        conn = cache_db()
+        conn.execute(
+            "INSERT OR REPLACE INTO itn (isin, itn, fetched_at) VALUES (?, ?, ?)",
+            (isin, itn, UTCNOW.isoformat()),
+        )
+        conn.commit()
+
+# Эмитент актива (заёмщик) меняется ещё реже ИНН — живёт ITN_CACHE_TTL_DAYS, "" тоже.
+def load_cached_issuer(asset_uid: str):
+    """Эмитент из кэша ("" — у актива его нет) или None, если надо спросить Тинькофф."""
+    if not USE_CACHE:
+        return None
+    with _CACHE_LOCK:
+        row = cache_db().execute("SELECT issuer, fetched_at FROM issuer WHERE asset_uid = ?", (asset_uid,)).fetchone()
+    if row is None or UTCNOW - datetime.fromisoformat(row[1]) > timedelta(days=ITN_CACHE_TTL_DAYS):
+        return None
+    return row[0]
+
+def store_issuer(asset_uid: str, issuer: str):
+    if not USE_CACHE:
+        return
+    with _CACHE_LOCK:
+        conn = cache_db()
+        conn.execute(
+            "INSERT OR REPLACE INTO issuer (asset_uid, issuer, fetched_at) VALUES (?, ?, ?)",
+            (asset_uid, issuer, UTCNOW.isoformat()),
+        )
+        conn.commit()
 
 # ---- Фильтрация облигаций (№12 уточнённая логика слегка) ----
 def is_available_bond(bond) -> bool:
@@ -233,223 +1219,1064 @@ def is_available_bond(bond) -> bool:
         and bond.call_date.year == 1970
     )
 
-# ---- Модель строки для Excel (№10) ----
-@dataclass
-class BondRow:
-    Имя: str
-    Тикер: str
-    Цена_плюс_НКД: float
-    Купон: float
-    Годовая_доходность: float  # как было (с учётом 0.87)
-    Доходность_к_погашению: object  # может быть "Н/д"
-    Купонов_в_год: int
-    Лет_до_погашения: float
-    Дюрация: float
-    Рейтинг_АКРА: str | None = None
-    Рейтинг_НРА: str | None = None
-    Рейтинг_НКР: str | None = None
-    Риск_Тинькофф: str | None = None
-    Сектор: str | None = None
+# ---- Колоночное хранение (№10) ----
+# Сразу после загрузки из ответа instruments.bonds() берутся только нужные поля — столбцами,
+# сам ответ с protobuf-объектами дальше не держим. Стадии сбора пишут результаты в столбцы
+# той же таблицы по номеру облигации, расчёты и вывод в Excel работают с массивами целиком.
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_DAY_US = 86_400_000_000
+
+def to_us(dt: datetime) -> int:
+    return (dt - _EPOCH) // _MICROSECOND
+
+def from_us(us) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(us))
+
+# расписание купонов одной облигации: даты (мкс от эпохи) и выплата units/nano
+CouponSchedule = namedtuple("CouponSchedule", "dates units nano")
+
+def coupon_schedule(events) -> CouponSchedule:
+    """Из событий API (coupon_date, pay_one_bond) или кортежей (дата, units, nano)."""
+    if events and not isinstance(events[0], tuple):
+        events = [(c.coupon_date, c.pay_one_bond.units, c.pay_one_bond.nano) for c in events]
+    return CouponSchedule(
+        dates=np.array([to_us(d) for d, _, _ in events], dtype=np.int64),
+        units=np.array([u for _, u, _ in events], dtype=np.int64),
+        nano=np.array([n for _, _, n in events], dtype=np.int64),
+    )
 
-# ---- Сбор данных и расчёты (№1,3,9,11 частично) ----
-def collect_bonds():
-    client = get_client()
-    # все инструменты
-    instruments = call_with_retry(lambda: client.instruments.bonds()).instruments
+def _risk_level(bond):
+    try:
+        return bond.risk_level.value
+    except Exception:
+        return "Не оценен"
 
-    # применим фильтр
-    bonds = [b for b in instruments if is_available_bond(b)]
-    if not bonds:
-        return []
+# что из BondTable попадает в снимок (кроме risk_level и купонов, у них своя раскладка)
+_SNAPSHOT_STRINGS = ("figi", "isin", "name", "ticker", "asset_uid", "issuer", "sector", "itn", "acra", "nra", "nkr")
+_SNAPSHOT_ARRAYS = ("coupons_per_year", "nominal", "aci", "maturity_us", "floating", "failed", "looked_up")
+
+class BondTable:
+    """Облигации выборки столбцами: поля инструмента, котировки и то, что собрали стадии."""
+
+    __slots__ = ("figi", "isin", "name", "ticker", "asset_uid", "issuer", "sector", "risk_level", "coupons_per_year",
+                 "nominal", "aci", "maturity_us", "floating", "quote", "has_price",
+                 "coupons", "itn", "acra", "nra", "nkr", "looked_up", "failed")
+
+    def __init__(self, bonds):
+        from bondsAnalytics import money
+        n = len(bonds)
+        self.figi = [b.figi for b in bonds]
+        self.isin = [b.isin for b in bonds]
+        self.name = [b.name for b in bonds]
+        self.ticker = [b.ticker for b in bonds]
+        # эмитента по активу заполняет resolve_issuers
+        self.asset_uid = [getattr(b, "asset_uid", "") or "" for b in bonds]
+        self.issuer = [""] * n
+        self.sector = [b.sector for b in bonds]
+        self.risk_level = [_risk_level(b) for b in bonds]
+        self.coupons_per_year = np.array([b.coupon_quantity_per_year for b in bonds], dtype=np.int64)
+        self.nominal = money([b.nominal.units for b in bonds], [b.nominal.nano for b in bonds])
+        self.aci = money([b.aci_value.units for b in bonds], [b.aci_value.nano for b in bonds])
+        self.maturity_us = np.array([to_us(b.maturity_date) for b in bonds], dtype=np.int64)
+        self.floating = np.array([b.floating_coupon_flag for b in bonds], dtype=bool)
+        self.quote = np.zeros(n)
+        self.has_price = np.zeros(n, dtype=bool)
+        # заполняются стадиями сбора
+        self.coupons = [None] * n
+        self.itn = [None] * n
+        self.acra = ["Отсутствует"] * n
+        self.nra = ["Отсутствует"] * n
+        self.nkr = ["Отсутствует"] * n
+        # рейтинги запрошены; у отсеянных при сборе облигаций их нет, хотя в снимок они попадают
+        self.looked_up = np.zeros(n, dtype=bool)
+        self.failed = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.figi)
+
+    def maturity_date(self, i) -> datetime:
+        return from_us(self.maturity_us[i])
+
+    def take(self, rows) -> "BondTable":
+        """Новая таблица только из облигаций с номерами rows, в том же порядке."""
+        rows = np.asarray(rows, dtype=np.int64)
+        table = BondTable.__new__(BondTable)
+        for name in self.__slots__:
+            column = getattr(self, name)
+            setattr(table, name, column[rows] if isinstance(column, np.ndarray) else [column[i] for i in rows])
+        return table
+
+    def put(self, rows, part: "BondTable", columns=None):
+        """Обратно в таблицу — столбцы part (все или только columns), взятой через take(rows)."""
+        for name in columns or self.__slots__:
+            column, values = getattr(self, name), getattr(part, name)
+            if isinstance(column, np.ndarray):
+                column[rows] = values
+            else:
+                for i, value in zip(rows, values):
+                    column[i] = value
+
+    def refresh_static(self, bonds):
+        """Свежие НКД и номинал из instruments.bonds(); выпуски, выпавшие из выборки, больше не выводятся."""
+        fresh = {b.figi: b for b in bonds}
+        for i, figi in enumerate(self.figi):
+            b = fresh.get(figi)
+            if b is None or not is_available_bond(b):
+                self.failed[i] = True
+                continue
+            self.nominal[i] = b.nominal.units + (b.nominal.nano / DIV)
+            self.aci[i] = b.aci_value.units + (b.aci_value.nano / DIV)
+
+    def drop_paid_coupons(self, now_us):
+        for i, schedule in enumerate(self.coupons):
+            if schedule is not None and (schedule.dates < now_us).any():
+                future = schedule.dates >= now_us
+                self.coupons[i] = CouponSchedule(*(column[future] for column in schedule))
+
+    def save(self, path):
+        """Снимок всего, кроме котировок: столбцы как есть, купоны — плоскими массивами с границами."""
+        schedules = [c if c is not None else coupon_schedule([]) for c in self.coupons]
+        columns = {name: np.array(["" if v is None else v for v in getattr(self, name)], dtype=str)
+                   for name in _SNAPSHOT_STRINGS}
+        columns.update({name: getattr(self, name) for name in _SNAPSHOT_ARRAYS})
+        columns["risk_level"] = np.array([v if isinstance(v, int) else -1 for v in self.risk_level], dtype=np.int64)
+        columns["coupon_offsets"] = np.concatenate(([0], np.cumsum([len(c.dates) for c in schedules]))).astype(np.int64)
+        for field in CouponSchedule._fields:
+            columns["coupon_" + field] = (np.concatenate([getattr(c, field) for c in schedules]) if schedules
+                                          else np.zeros(0, dtype=np.int64))
+        columns["saved_at"] = np.array(to_us(UTCNOW), dtype=np.int64)
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        table = cls.__new__(cls)
+        with np.load(path) as data:
+            n = len(data["figi"])
+            # в старых снимках нет эмитентов и признака запрошенных рейтингов
+            for name in _SNAPSHOT_STRINGS:
+                setattr(table, name, data[name].tolist() if name in data else [""] * n)
+            for name in _SNAPSHOT_ARRAYS:
+                setattr(table, name, data[name] if name in data else np.ones(n, dtype=bool))
+            table.itn = [itn or None for itn in table.itn]
+            table.risk_level = [v if v >= 0 else "Не оценен" for v in data["risk_level"].tolist()]
+            offsets = data["coupon_offsets"]
+            flat = [data["coupon_" + field] for field in CouponSchedule._fields]
+            table.coupons = [CouponSchedule(*(column[offsets[i]:offsets[i + 1]] for column in flat))
+                             for i in range(len(offsets) - 1)]
+            saved_at = from_us(data["saved_at"])
+        if UTCNOW - saved_at > timedelta(days=COUPON_CACHE_TTL_DAYS):
+            logging.warning("Snapshot %s is from %s, coupons and ratings may be stale", path, saved_at.date())
+        table.quote = np.zeros(len(table.figi))
+        table.has_price = np.zeros(len(table.figi), dtype=bool)
+        return table
+
+    def set_prices(self, last_prices):
+        """Котировки из get_last_prices (в процентах от номинала); нет котировки — цена 0, как раньше."""
+        position = {figi: i for i, figi in enumerate(self.figi)}
+        for lp in last_prices:
+            i = position.get(lp.figi)
+            if i is not None:
+                self.quote[i] = lp.price.units + (lp.price.nano / DIV)
+                self.has_price[i] = True
 
-    # батч котировок (№9)
-    figis = [b.figi for b in bonds]
-    last_prices_resp = call_with_retry(lambda: client.market_data.get_last_prices(figi=figis))
-    last_prices_map = {lp.figi: lp.price for lp in last_prices_resp.last_prices}
+# ---- Сбор данных и расчёты (№1,3,9,11 частично) ----
+def coupons_horizon(maturity_date):
+    # если по какой-то причине дата погашения не задана/в прошлом — всё равно ограничим вменяемо
+    if not maturity_date or maturity_date <= UTCNOW:
+        return UTCNOW + timedelta(days=365 * 3)
+    return max(maturity_date + timedelta(days=7), UTCNOW + timedelta(days=365 * 3))
+
+def fetch_coupons(client, table: BondTable, i):
+    # второй проход: купоны уже есть или их не удалось получить
+    if table.coupons[i] is not None or table.failed[i]:
+        return
+    try:
+        maturity_date = table.maturity_date(i)
+        date_to = coupons_horizon(maturity_date)
+        schedule = load_cached_coupons(table.figi[i], table.floating[i], maturity_date, UTCNOW, date_to)
+        if USE_CACHE:
+            record_cache("coupons_db", schedule is not None)
+        if schedule is None:
+            events = get_coupons_with_smart_retry(client, table.figi[i], UTCNOW, date_to)
+            store_coupons(table.figi[i], table.floating[i], events, date_to)
+            schedule = coupon_schedule(events)
+        table.coupons[i] = schedule
+    except Exception as e:
+        logging.exception("Error on bond %s: %s", table.ticker[i], e)
+        table.failed[i] = True
+        return
+    journal_coupons(table, i)
+
+def lookup_ratings(table: BondTable, i):
+    # ошибки источников ниже не выходят наружу — рейтинги облигации считаются запрошенными
+    table.looked_up[i] = True
+    # для госов внешние источники не опрашиваем; ИНН к этому моменту уже нашёл resolve_issuers
+    if table.sector[i] == "government":
+        return
+    try:
+        table.acra[i] = get_acra_rating_by_isin(table.isin[i])
+    except Exception as e:
+        logging.warning("ACRA error for %s: %s", table.isin[i], e)
+        table.acra[i] = "Ошибка запроса"
+
+    itn = table.itn[i]
+    if not itn:
+        return
+    try:
+        table.nra[i] = get_NRA_rating_by_itn(itn)
+    except Exception as e:
+        logging.warning("NRA error for %s: %s", itn, e)
+        table.nra[i] = "Ошибка запроса"
+    try:
+        table.nkr[i] = get_NKR_rating_by_itn(itn)
+    except Exception as e:
+        logging.warning("NKR error for %s: %s", itn, e)
+        table.nkr[i] = "Ошибка запроса"
+
+# столбцы итоговой таблицы (и листов Excel) по порядку
+ROW_COLUMNS = (
+    "Имя", "Тикер", "Цена_плюс_НКД", "Купон",
+    "Годовая_доходность",        # как было (с учётом 0.87)
+    "Доходность_к_погашению",    # может быть "Н/д"
+    "Купонов_в_год", "Лет_до_погашения", "Дюрация",
+    "Эффективная_доходность",    # IRR до налога, "Н/д" если не считается
+    "Дюрация_Маколея", "Модифицированная_дюрация", "Выпуклость",
+    "Рейтинг_АКРА", "Рейтинг_НРА", "Рейтинг_НКР", "Риск_Тинькофф", "Сектор",
+)
+
+def _or_na(values, na_mask):
+    """Столбец чисел, где na_mask — «Н/д»."""
+    column = np.asarray(values, dtype=object)
+    column[na_mask] = "Н/д"
+    return column
+
+def _rounded_or_na(values, ndigits):
+    from bondsAnalytics import round_like_python
+    values = np.asarray(values, dtype=np.float64)
+    na = np.isnan(values)
+    return _or_na(round_like_python(np.nan_to_num(values), ndigits), na)
+
+def compute_columns(table: BondTable, rows=None) -> dict:
+    """Столбцы итоговой таблицы для всех успешно собранных облигаций (или только для номеров rows)
+    за несколько векторных проходов; с --scenarios после них — столбцы сценариев ставок."""
+    from bondsAnalytics import bond_metrics, cashflow_matrix, discounted_metrics, money
+    ok = np.flatnonzero(~table.failed) if rows is None else np.asarray(rows, dtype=np.int64)
+    schedules = [table.coupons[i] for i in ok]
+    counts = np.array([len(c.dates) for c in schedules], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def flat(field, dtype):
+        return np.concatenate([getattr(c, field) for c in schedules]) if schedules else np.zeros(0, dtype)
+
+    now_us = to_us(UTCNOW)
+    has_price = table.has_price[ok]
+    nominal = table.nominal[ok]
+    # целые дни, как timedelta.days (с округлением вниз)
+    maturity_days = (table.maturity_us[ok] - now_us) // _DAY_US
+    coupon_values = money(flat("units", np.int64), flat("nano", np.int64))
+    coupon_days = (flat("dates", np.int64) - now_us) // _DAY_US
+
+    metrics = bond_metrics(
+        quote=table.quote[ok],
+        has_price=has_price,
+        nominal=nominal,
+        aci=table.aci[ok],
+        coupons_per_year=table.coupons_per_year[ok],
+        maturity_days=maturity_days,
+        coupon_values=coupon_values,
+        coupon_days=coupon_days,
+        offsets=offsets,
+    )
+    # дисконтированные метрики — от той же цены + НКД и тех же купонов; без цены и при неизвестных купонах — Н/д
+    cashflows, times = cashflow_matrix(nominal, maturity_days, coupon_values, coupon_days, offsets)
+    discounted = discounted_metrics(metrics["price_dirty"], cashflows, times,
+                                    valid=has_price & ~metrics["ytm_na"] & (maturity_days > 0))
+
+    sector = np.array(table.sector, dtype=object)[ok]
+    government = sector == "government"
+
+    def ratings(column):
+        return np.where(government, "Отсутствует", np.array(column, dtype=object)[ok])
+
+    columns = {
+        "Имя": np.array(table.name, dtype=object)[ok],
+        "Тикер": np.array(table.ticker, dtype=object)[ok],
+        "Цена_плюс_НКД": metrics["price_dirty"],
+        "Купон": metrics["coupon"],
+        "Годовая_доходность": metrics["yield"],
+        "Доходность_к_погашению": _or_na(metrics["ytm"], metrics["ytm_na"]),
+        "Купонов_в_год": table.coupons_per_year[ok],
+        "Лет_до_погашения": metrics["years_to_maturity"],
+        "Дюрация": metrics["duration"],
+        "Эффективная_доходность": _rounded_or_na(discounted["irr"] * 100, 2),
+        "Дюрация_Маколея": _rounded_or_na(discounted["macaulay"], 2),
+        "Модифицированная_дюрация": _rounded_or_na(discounted["modified"], 2),
+        "Выпуклость": _rounded_or_na(discounted["convexity"], 2),
+        "Рейтинг_АКРА": ratings(table.acra),
+        "Рейтинг_НРА": ratings(table.nra),
+        "Рейтинг_НКР": ratings(table.nkr),
+        "Риск_Тинькофф": np.array(table.risk_level, dtype=object)[ok],
+        "Сектор": np.array([translate_sector(x) for x in sector], dtype=object),
+    }
+    if WITH_SCENARIOS:
+        columns.update(scenario_columns(cashflows, times, discounted["irr"], metrics["price_dirty"]))
+    return columns
+
+# ---- Сценарии ставок (--scenarios) ----
+# Все облигации переоцениваются разом под каждым сценарием SCENARIOS (bondsAnalytics.scenario_prices):
+# столбец «Сценарий_<имя>» — изменение цены + НКД в процентах. Без эффективной доходности — «Н/д».
+SCENARIO_PREFIX = "Сценарий_"
+SCENARIO_SHEET = "Сценарии"
+# столбцы листа «Сценарии» перед самими сценариями
+SCENARIO_BASE_COLUMNS = ("Имя", "Тикер", "Сектор", "Цена_плюс_НКД", "Эффективная_доходность",
+                         "Модифицированная_дюрация", "Выпуклость")
+
+def scenario_columns(cashflows, times, irr, price_dirty) -> dict:
+    from bondsAnalytics import scenario_prices
+    prices = scenario_prices(cashflows, times, irr, list(SCENARIOS.values()))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (prices / price_dirty - 1) * 100
+    return {SCENARIO_PREFIX + name: _rounded_or_na(values, 2) for name, values in zip(SCENARIOS, change)}
+
+def scenario_names(columns: dict) -> list:
+    return [name for name in columns if name.startswith(SCENARIO_PREFIX)]
+
+def take_rows(columns: dict, index) -> dict:
+    """Подвыборка строк (маска или номера) из столбцов итоговой таблицы."""
+    return {name: values[index] for name, values in columns.items()}
+
+# ---- Отсев по доходности, сроку и дюрации до запросов ИНН и рейтингов (SCREEN) ----
+# Как только есть цены и купоны, считаются столбцы итоговой таблицы (без рейтингов) и отбираются
+# облигации, прошедшие пороги SCREEN; ИНН и рейтинги потом запрашиваются только для них.
+# Сбор возвращает и сохраняет в снимок все облигации — отсеиваются они только при выводе.
+def screening_enabled() -> bool:
+    return any(SCREEN.get(key) for key in ("min_yield", "max_years", "max_duration", "top_k"))
+
+def screen_rows(table: BondTable) -> "np.ndarray":
+    """Номера облигаций, прошедших пороги SCREEN: Годовая_доходность >= min_yield, Лет_до_погашения <= max_years,
+    Дюрация <= max_duration и из них top_k лучших по Годовая_доходность. Порядок облигаций сохраняется."""
+    rows = np.flatnonzero(~table.failed)
+    columns = compute_columns(table, rows)
+    keep = np.ones(len(rows), dtype=bool)
+    if SCREEN.get("min_yield"):
+        keep &= columns["Годовая_доходность"] >= SCREEN["min_yield"]
+    if SCREEN.get("max_years"):
+        keep &= columns["Лет_до_погашения"] <= SCREEN["max_years"]
+    if SCREEN.get("max_duration"):
+        keep &= columns["Дюрация"] <= SCREEN["max_duration"]
+    survivors = rows[keep]
+    top_k = SCREEN.get("top_k")
+    if top_k and len(survivors) > top_k:
+        best = np.argsort(-columns["Годовая_доходность"][keep], kind="stable")[:top_k]
+        survivors = np.sort(survivors[best])
+    logging.info("Screening kept %d of %d bonds", len(survivors), len(rows))
+    METRICS.set("bonds_screened", len(survivors), result="kept")
+    METRICS.set("bonds_screened", len(rows) - len(survivors), result="dropped")
+    return survivors
+
+def screen_table(table: BondTable) -> BondTable:
+    """Таблица для вывода: без отсева — как есть, с отсевом — только прошедшие его облигации."""
+    return table.take(screen_rows(table)) if screening_enabled() else table
+
+# ---- Журнал сбора и --resume ----
+# Результат каждой стадии сразу дописывается строкой JSON в JOURNAL_FILE: купоны облигации — как только
+# они получены, ИНН и рейтинги — отдельной строкой после стадий поиска. Прерванный сбор с --resume берёт
+# всё это из журнала и запрашивает только остальное; котировки и НКД всё равно запрашиваются заново.
+# После удачного сбора журнал удаляется.
+_JOURNAL = None
+
+class RunJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.coupons = {}  # figi -> CouponSchedule
+        self.lookups = {}  # figi -> (itn, acra, nra, nkr)
+        self.issuers = {}  # figi -> эмитент из get_asset_by
+        self.itns = {}  # figi -> ИНН эмитента, найденный раньше рейтингов
+        self._lock = threading.Lock()
+        if resume:
+            self._read()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _read(self):
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            logging.warning("No journal %s to resume from, collecting from scratch", self.path)
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # последняя строка могла оборваться на середине
+                    continue
+                if "dates" in entry:
+                    self.coupons[entry["figi"]] = CouponSchedule(
+                        *(np.array(entry[field], dtype=np.int64) for field in CouponSchedule._fields))
+                if "itn" in entry:
+                    self.lookups[entry["figi"]] = (entry["itn"], entry["acra"], entry["nra"], entry["nkr"])
+                if "issuer" in entry:
+                    self.issuers[entry["figi"]] = entry["issuer"]
+                if "issuer_itn" in entry:
+                    self.itns[entry["figi"]] = entry["issuer_itn"]
+        logging.info("Resuming from %s: %d bonds with coupons, %d with ITN, %d complete",
+                     self.path, len(self.coupons), len(self.itns), len(self.lookups))
+
+    def restore(self, table: BondTable):
+        """Купоны, ИНН и рейтинги из журнала — в таблицу; прошедшие с тех пор купоны отбрасываются."""
+        for i, figi in enumerate(table.figi):
+            schedule = self.coupons.get(figi)
+            if schedule is not None:
+                table.coupons[i] = schedule
+            if not table.issuer[i]:
+                table.issuer[i] = self.issuers.get(figi, "")
+            done = self.lookups.get(figi)
+            if done is not None:
+                table.itn[i], table.acra[i], table.nra[i], table.nkr[i] = done
+                table.looked_up[i] = True
+            elif table.itn[i] is None and figi in self.itns:
+                table.itn[i] = self.itns[figi]
+        table.drop_paid_coupons(to_us(UTCNOW))
+
+    def pending(self, table: BondTable, lookups=True) -> "np.ndarray":
+        """Номера облигаций, которых в журнале ещё нет (с lookups — законченных вместе с ИНН и рейтингами)."""
+        done = self.lookups if lookups else self.coupons
+        return np.array([i for i, figi in enumerate(table.figi) if figi not in done], dtype=np.int64)
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            # потоки прерванного конвейера могут досчитать стадию уже после закрытия журнала
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    # облигации с ошибкой не записываем: --resume попробует их снова
+    def record_coupons(self, table: BondTable, i):
+        if table.failed[i]:
+            return
+        schedule = table.coupons[i]
+        self._write({"figi": table.figi[i],
+                     **{field: getattr(schedule, field).tolist() for field in CouponSchedule._fields}})
+        self.coupons[table.figi[i]] = schedule
+
+    # эмитент и ИНН пишутся сразу, не дожидаясь рейтингов: --resume не повторит get_asset_by и isin.ru
+    def record_issuer(self, table: BondTable, i):
+        self._write({"figi": table.figi[i], "issuer": table.issuer[i]})
+        self.issuers[table.figi[i]] = table.issuer[i]
+
+    def record_itn(self, table: BondTable, i):
+        if table.failed[i]:
+            return
+        self._write({"figi": table.figi[i], "issuer": table.issuer[i], "issuer_itn": table.itn[i]})
+        self.itns[table.figi[i]] = table.itn[i]
+
+    def record_lookups(self, table: BondTable, i):
+        if table.failed[i]:
+            return
+        done = (table.itn[i], table.acra[i], table.nra[i], table.nkr[i])
+        self._write({"figi": table.figi[i], **dict(zip(("itn", "acra", "nra", "nkr"), done))})
+        self.lookups[table.figi[i]] = done
+
+    def close(self, remove=False):
+        with self._lock:
+            self._file.close()
+        if remove:
+            os.remove(self.path)
+
+def open_journal(resume=False):
+    global _JOURNAL
+    if not JOURNAL_FILE:
+        if resume:
+            logging.warning("JOURNAL_FILE is empty, nothing to resume from")
+        return
+    _JOURNAL = RunJournal(JOURNAL_FILE, resume)
+
+def close_journal(remove=False):
+    global _JOURNAL
+    if _JOURNAL is not None:
+        _JOURNAL.close(remove)
+        _JOURNAL = None
+
+def journal_coupons(table: BondTable, i):
+    if _JOURNAL is not None:
+        _JOURNAL.record_coupons(table, i)
+
+def journal_issuer(table: BondTable, i):
+    if _JOURNAL is not None:
+        _JOURNAL.record_issuer(table, i)
+
+def journal_itn(table: BondTable, i):
+    if _JOURNAL is not None:
+        _JOURNAL.record_itn(table, i)
+
+def journal_lookups(table: BondTable, i):
+    if _JOURNAL is not None:
+        _JOURNAL.record_lookups(table, i)
+
+def restore_journal(table: BondTable):
+    if _JOURNAL is not None:
+        _JOURNAL.restore(table)
+
+def pending_part(table: BondTable, lookups=True):
+    """(номера, подтаблица) облигаций, которые ещё надо собрать; без журнала — вся таблица."""
+    if _JOURNAL is None:
+        return None, table
+    _JOURNAL.restore(table)
+    pending = _JOURNAL.pending(table, lookups)
+    return pending, table.take(pending)
+
+# проход без поиска трогает только купоны, а ИНН в это время может дописывать resolve_issuers
+COUPON_COLUMNS = ("coupons", "failed")
+
+def run_engine(engine: str, client, table: BondTable, lookups=True, desc="Прогресс"):
+    from tqdm import tqdm
+    pending, part = pending_part(table, lookups)
+    pbar = tqdm(total=len(table), initial=len(table) - len(part), desc=desc, unit="облигация")
+    ENGINES[engine](client, part, pbar, lookups=lookups)
+    pbar.close()
+    if pending is not None:
+        table.put(pending, part, None if lookups else COUPON_COLUMNS)
 
-    rows: list[BondRow] = []
-    pbar = tqdm(total=len(bonds), desc="Прогресс", unit="облигация")
+def in_background(fn, *args):
+    """fn(*args) в фоновом потоке; возвращает функцию, которая дожидается его и пробрасывает ошибку."""
+    error = []
 
-    for b in bonds:
-        pbar.update(1)
+    def run():
         try:
-            nominal = b.nominal.units + (b.nominal.nano / DIV)
-
-            # Купоны на «долгий» горизонт (как было — до 2*3650 дней это избыточно; ставим 30 лет)
-            '''
-            coupons = call_with_retry(
-                lambda: client.instruments.get_bond_coupons(
-                    figi=b.figi, from_=UTCNOW, to=UTCNOW + timedelta(days=365 * 30)
-                )
-            ).events
-            '''
-            end_to = b.maturity_date
-
-            # если по какой-то причине дата погашения не задана/в прошлом — всё равно ограничим вменяемо
-            if not end_to or end_to <= UTCNOW:
-                end_to = UTCNOW + timedelta(days=365 * 3)
-            else:
-                end_to = max(end_to + timedelta(days=7), UTCNOW + timedelta(days=365 * 3))
+            fn(*args)
+        except BaseException as e:
+            error.append(e)
 
-            coupons = get_coupons_with_smart_retry(client, b.figi, UTCNOW, end_to)
+    thread = threading.Thread(target=run, name=fn.__name__, daemon=True)
+    thread.start()
 
-            # купон (первый будущий)
-            try:
-                coupon_value = coupons[0].pay_one_bond.units + (coupons[0].pay_one_bond.nano / DIV)
-            except Exception:
-                coupon_value = 0.0
-
-            # цена
-            quotation = last_prices_map.get(b.figi)
-            if quotation is not None:
-                q = quotation
-                # как было: денежная цена = (units + nano/DIV)/100 * nominal
-                price_clean = (q.units + (q.nano / DIV)) / 100.0 * nominal
-            else:
-                price_clean = 0.0
+    def wait():
+        thread.join()
+        if error:
+            raise error[0]
+    return wait
 
-            aci = b.aci_value.units + (b.aci_value.nano / DIV)
-            price_dirty = price_clean + aci
+def collect_serial(client, table: BondTable, pbar, lookups=True):
+    for i in range(len(table)):
+        pbar.update(1)
+        fetch_coupons(client, table, i)
+        if lookups and not table.failed[i]:
+            lookup_ratings(table, i)
+            journal_lookups(table, i)
+
+# ---- Конвейер: стадии с собственными потоками, связанные ограниченными очередями ----
+# По очередям идут номера облигаций, результаты стадии пишут в столбцы BondTable.
+_STOP = object()
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """q.put, который не зависает навсегда: после stop ждать читателя уже бессмысленно."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
-            # годовая доходность (как было, с «0.87»)
-            try:
-                yeild = round((0.87 * (coupon_value * b.coupon_quantity_per_year)) /
-                              (price_clean + aci), 3) * 100
-            except Exception:
-                yeild = 0.0
-
-            years_before_maturity = round((b.maturity_date - UTCNOW).days / 365.25, 1)
-
-            # duration «как было» — без дисконтирования (№4 исключён)
-            duration_acc = 0.0
-            common_income = 0.0
-            for c in coupons:
-                coupon_cost = c.pay_one_bond.units + (c.pay_one_bond.nano / DIV)
-                years_before_payment = round((c.coupon_date - UTCNOW).days / 365.25, 2)
-                duration_acc += coupon_cost * years_before_payment
-                common_income += coupon_cost
-            common_income += nominal
-            try:
-                duration = round((duration_acc + nominal * years_before_maturity) / common_income, 2)
-            except Exception:
-                duration = 0.0
-
-            # простая «доходность к погашению» из исходника (№4 исключён)
-            ytm = 0
-            coupon_income_sum = 0
-            ytm_na = False
-            for c in coupons:
-                if c.pay_one_bond.units + (c.pay_one_bond.nano / DIV) == 0:
-                    ytm_na = True
-                coupon_income_sum += c.pay_one_bond.units + (c.pay_one_bond.nano / DIV)
-
-            if ytm_na:
-                ytm_value = "Н/д"
-            else:
-                try:
-                    days_to_maturity = (b.maturity_date - UTCNOW).days
-                    ytm_val = (0.87 * 365 * (coupon_income_sum + nominal - price_clean - aci) /
-                               (days_to_maturity * (price_clean + aci)))
-                    ytm_value = round(ytm_val, 3) * 100
-                except Exception:
-                    ytm_value = 0.0
-
-            # Риски/секторы/рейтинги (№8 кэш, без запросов для госов)
-            sector_ru = translate_sector(b.sector)
-            try:
-                risk_tinkoff = b.risk_level.value
-            except Exception:
-                risk_tinkoff = "Не оценен"
+def _get(q: queue.Queue, stop: threading.Event):
+    """q.get, который после stop возвращает _STOP."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _STOP
 
-            acra = "Отсутствует"
-            nra = "Отсутствует"
-            nkr = "Отсутствует"
+def _start_stage(name, fn, workers, in_q, out_q, table: BondTable, stop: threading.Event, errors: list):
+    """Запускает workers потоков стадии; после последнего из них в out_q уходит _STOP.
 
-            if b.sector != "government":
-                try:
-                    acra = get_acra_rating_by_isin(b.isin)
-                except Exception as e:
-                    logging.warning("ACRA error for %s: %s", b.isin, e)
-                    acra = "Ошибка запроса"
+    Ошибка fn на облигации помечает её failed. Всё, что не Exception (KeyboardInterrupt, SystemExit),
+    попадает в errors и останавливает весь конвейер через stop; _STOP дальше уходит в любом случае.
+    """
+    workers = max(1, workers)
+    remaining = [workers]
+    lock = threading.Lock()
 
-                try:
-                    itn = get_company_itn(b.isin)
-                    if itn:
-                        try:
-                            nra = get_NRA_rating_by_itn(itn)
-                        except Exception as e:
-                            logging.warning("NRA error for %s: %s", itn, e)
-                            nra = "Ошибка запроса"
-                        try:
-                            nkr = get_NKR_rating_by_itn(itn)
-                        except Exception as e:
-                            logging.warning("NKR error for %s: %s", itn, e)
-                            nkr = "Ошибка запроса"
-                    else:
-                        nra = "Отсутствует"
-                        nkr = "Отсутствует"
-                except Exception as e:
-                    logging.warning("ITN error for %s: %s", b.isin, e)
-                    nra = "Ошибка запроса ИНН"
-                    nkr = "Ошибка запроса ИНН"
-
-            # формирование строки
-            row = BondRow(
-                Имя=b.name,
-                Тикер=b.ticker,
-                Цена_плюс_НКД=round(price_dirty, 2),
-                Купон=round(coupon_value, 2),
-                Годовая_доходность=yeild,
-                Доходность_к_погашению=ytm_value,
-                Купонов_в_год=b.coupon_quantity_per_year,
-                Лет_до_погашения=years_before_maturity,
-                Дюрация=duration,
-                Рейтинг_АКРА=acra if b.sector != "government" else "Отсутствует",
-                Рейтинг_НРА=nra if b.sector != "government" else "Отсутствует",
-                Рейтинг_НКР=nkr if b.sector != "government" else "Отсутствует",
-                Риск_Тинькофф=risk_tinkoff,
-                Сектор=sector_ru,
-            )
-
-            rows.append(row)
-        except Exception as e:
-            logging.exception("Error on bond %s: %s", getattr(b, "ticker", "?"), e)
+    def worker():
+        try:
+            while True:
+                i = _get(in_q, stop)
+                if i is _STOP:
+                    _put(in_q, _STOP, stop)  # вернём стоп для соседних потоков этой стадии
+                    break
+                if not table.failed[i]:
+                    try:
+                        fn(table, i)
+                    except Exception as e:
+                        logging.exception("Stage %s failed on %s: %s", name, table.ticker[i], e)
+                        table.failed[i] = True
+                if not _put(out_q, i, stop):
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                _put(out_q, _STOP, stop)
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+def collect_pipeline(client, table: BondTable, pbar, lookups=True):
+    stages = [
+        ("coupons", lambda table, i: fetch_coupons(client, table, i)),
+        ("ratings", lookup_ratings),
+    ]
+    if not lookups:
+        stages = stages[:1]
+    queues = [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in range(len(stages) + 1)]
+    stop, errors = threading.Event(), []
+
+    def feed():
+        for i in range(len(table)):
+            if not _put(queues[0], i, stop):
+                return
+        _put(queues[0], _STOP, stop)
+
+    threads = [threading.Thread(target=feed, name="feed", daemon=True)]
+    threads[0].start()
+    for n, (name, fn) in enumerate(stages):
+        threads += _start_stage(name, fn, PIPELINE_WORKERS.get(name, 1), queues[n], queues[n + 1], table, stop, errors)
 
-        # уважим лимиты API между итерациями (как было)
-        time.sleep(API_DELAY)
+    try:
+        while True:
+            i = _get(queues[-1], stop)
+            if i is _STOP:
+                break
+            if lookups:
+                journal_lookups(table, i)
+            pbar.update(1)
+    finally:
+        # при прерывании дожидаемся стадий: иначе они продолжили бы писать в таблицу и журнал
+        # уже следующего запуска (--serve). Текущий запрос каждого потока доработает до конца.
+        stop.set()
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+
+ENGINES = {
+    "serial": collect_serial,
+    "pipeline": collect_pipeline,
+}
+
+def collect_bonds(engine: str = "serial", resume=False) -> BondTable:
+    refresh_clock()
+    enable_rate_limits()
+    open_journal(resume)
+    try:
+        table = asyncio.run(collect_bonds_async()) if engine == "async" else collect_bonds_sync(engine)
+    except BaseException:
+        # журнал остаётся для --resume
+        close_journal()
+        raise
+    close_journal(remove=True)
+    return table
+
+def collect_bonds_sync(engine: str) -> BondTable:
+    client = get_client()
+    # все инструменты; применим фильтр и оставим только нужные поля
+    table = BondTable([b for b in call_with_retry(lambda: client.instruments.bonds(), method="bonds").instruments
+                       if is_available_bond(b)])
+
+    if len(table):
+        # батч котировок (№9)
+        table.set_prices(call_with_retry(lambda: client.market_data.get_last_prices(figi=table.figi), method="get_last_prices").last_prices)
+        restore_journal(table)
+
+        screening = screening_enabled()
+        workers = 1 if engine == "serial" else PIPELINE_WORKERS.get("itn", 1)
+        # ИНН от купонов не зависят: без отсева конвейер ищет их параллельно с купонами
+        wait_issuers = None
+        if not screening and engine != "serial":
+            wait_issuers = in_background(resolve_issuers, client, table, workers)
+        run_engine(engine, client, table, lookups=False, desc="Купоны")
+        # ИНН и рейтинги — только для прошедших отсев; купоны второй раз не запрашиваются
+        survivors = screen_rows(table) if screening else None
+        part = table if survivors is None else table.take(survivors)
+        if wait_issuers is None:
+            resolve_issuers(client, part, workers)
+        else:
+            wait_issuers()
+        run_engine(engine, client, part, desc="Рейтинги")
+        if survivors is not None:
+            table.put(survivors, part)
+    return table
+
+def reprice_bonds() -> BondTable:
+    """--reprice: купоны, ИНН, рейтинги и сектор — из снимка прошлого полного запуска; заново только НКД и цены."""
+    if not os.path.exists(SNAPSHOT_FILE):
+        raise ValueError(f"Нет снимка {SNAPSHOT_FILE}: сначала выполните полный запуск без --reprice")
+    refresh_clock()
+    table = BondTable.load(SNAPSHOT_FILE)
 
-    pbar.close()
-    return rows
+    client = get_client()
+    table.refresh_static(call_with_retry(lambda: client.instruments.bonds(), method="bonds").instruments)
+    table.drop_paid_coupons(to_us(UTCNOW))
+    if len(table):
+        table.set_prices(call_with_retry(lambda: client.market_data.get_last_prices(figi=table.figi), method="get_last_prices").last_prices)
+    table = screen_table(table)
+    lookup_missing(client, table)
+    return table
+
+def lookup_missing(client, table: BondTable):
+    """ИНН и рейтинги для строк снимка, отсеянных при сборе, — с другими порогами они идут в вывод."""
+    missing = np.flatnonzero(~table.looked_up & ~table.failed)
+    if not len(missing):
+        return
+    logging.info("%d bonds have no ratings in the snapshot, looking them up", len(missing))
+    # ИНН эмитентов, уже найденные по строкам с рейтингами, берутся из таблицы
+    resolve_issuers(client, table, PIPELINE_WORKERS.get("itn", 1),
+                    [i for i in missing if table.sector[i] != "government"])
+    for i in missing:
+        lookup_ratings(table, i)
+
+# ---- asyncio: много запросов купонов одновременно через асинхронный клиент Тинькофф ----
+async def fetch_coupons_async(client, table: BondTable, i, semaphore):
+    if table.coupons[i] is not None or table.failed[i]:
+        return
+    try:
+        maturity_date = table.maturity_date(i)
+        date_to = coupons_horizon(maturity_date)
+        schedule = load_cached_coupons(table.figi[i], table.floating[i], maturity_date, UTCNOW, date_to)
+        if USE_CACHE:
+            record_cache("coupons_db", schedule is not None)
+        if schedule is None:
+            async with semaphore:
+                events = await get_coupons_with_smart_retry_async(client, table.figi[i], UTCNOW, date_to)
+            store_coupons(table.figi[i], table.floating[i], events, date_to)
+            schedule = coupon_schedule(events)
+        table.coupons[i] = schedule
+    except Exception as e:
+        logging.exception("Error on bond %s: %s", table.ticker[i], e)
+        table.failed[i] = True
+        return
+    journal_coupons(table, i)
+
+async def process_bond_async(client, table: BondTable, i, semaphore, lookups=True):
+    await fetch_coupons_async(client, table, i, semaphore)
+    if lookups and not table.failed[i]:
+        # скрейперы синхронные — уводим их в пул потоков, чтобы не держать цикл событий
+        await asyncio.to_thread(lookup_ratings, table, i)
+        journal_lookups(table, i)
+
+async def collect_bonds_async() -> BondTable:
+    from tqdm import tqdm
+    async with async_client() as client:
+        instruments = (await async_call_with_retry(client.instruments.bonds)).instruments
+        table = BondTable([b for b in instruments if is_available_bond(b)])
+        del instruments
+
+        if len(table):
+            last_prices = await async_call_with_retry(client.market_data.get_last_prices, figi=table.figi)
+            table.set_prices(last_prices.last_prices)
+            restore_journal(table)
+
+            semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+
+            async def process_all(table, lookups, desc):
+                pending, part = pending_part(table, lookups)
+                tasks = [asyncio.create_task(process_bond_async(client, part, i, semaphore, lookups))
+                         for i in range(len(part))]
+                pbar = tqdm(total=len(table), initial=len(table) - len(part), desc=desc, unit="облигация")
+                for fut in asyncio.as_completed(tasks):
+                    await fut
+                    pbar.update(1)
+                pbar.close()
+                if pending is not None:
+                    table.put(pending, part, None if lookups else COUPON_COLUMNS)
+
+            screening = screening_enabled()
+            # ИНН от купонов не зависят: без отсева ищем их параллельно с купонами
+            issuers = None if screening else asyncio.create_task(resolve_issuers_async(client, table))
+            await process_all(table, False, "Купоны")
+            if screening:
+                survivors = screen_rows(table)
+                part = table.take(survivors)
+                await resolve_issuers_async(client, part)
+                await process_all(part, True, "Рейтинги")
+                table.put(survivors, part)
+            else:
+                await issuers
+                await process_all(table, True, "Рейтинги")
+
+    return table
 
 # ---- Excel вывод через pandas + xlsxwriter (№14). Оставляем autofit() (№5 исключён) ----
-def write_excel(government_rows: list[BondRow], corporate_rows: list[BondRow], filename: str):
+def has_any_rating(columns):
+    """Маска строк, у которых есть хоть один рейтинг (для --clear); columns — DataFrame или словарь столбцов."""
+    return ~(
+        (columns["Рейтинг_АКРА"] == "Не оценен") &
+        (columns["Рейтинг_НРА"] == "Не оценен") &
+        (columns["Рейтинг_НКР"] == "Не оценен")
+    )
+
+def write_excel(government: dict, corporate: dict, filename: str):
     # сортировка по «Годовая_доходность» по убыванию (как было по yeild)
-    df_gov = pd.DataFrame([asdict(r) for r in government_rows]).sort_values("Годовая_доходность", ascending=False)
-    df_corp = pd.DataFrame([asdict(r) for r in corporate_rows]).sort_values("Годовая_доходность", ascending=False)
+    scenarios = scenario_names(government)
+    df_gov = pd.DataFrame(government, columns=[*ROW_COLUMNS, *scenarios]).sort_values("Годовая_доходность", ascending=False)
+    df_corp = pd.DataFrame(corporate, columns=[*ROW_COLUMNS, *scenarios]).sort_values("Годовая_доходность", ascending=False)
 
     # фильтр «не писать без рейтингов» только для корп. листа (и с исправленной проверкой №6)
     global NOT_WRITE_WITHOUT_RATING
     if NOT_WRITE_WITHOUT_RATING and not df_corp.empty:
-        mask_has_any = ~(
-            (df_corp["Рейтинг_АКРА"] == "Не оценен") &
-            (df_corp["Рейтинг_НРА"] == "Не оценен") &
-            (df_corp["Рейтинг_НКР"] == "Не оценен")
-        )
-        df_corp = df_corp[mask_has_any]
+        df_corp = df_corp[has_any_rating(df_corp)]
 
     with pd.ExcelWriter(filename, engine="xlsxwriter") as writer:
-        df_gov.to_excel(writer, sheet_name="Государственные", index=False)
-        df_corp.to_excel(writer, sheet_name="Корпоративные", index=False)
+        df_gov.to_excel(writer, sheet_name="Государственные", index=False, columns=ROW_COLUMNS)
+        df_corp.to_excel(writer, sheet_name="Корпоративные", index=False, columns=ROW_COLUMNS)
+        if scenarios:
+            df_scenarios = pd.concat([df_gov, df_corp]).sort_values("Годовая_доходность", ascending=False)
+            df_scenarios.to_excel(writer, sheet_name=SCENARIO_SHEET, index=False,
+                                  columns=[*SCENARIO_BASE_COLUMNS, *scenarios])
 
         # оставляем попытку autofit(), как в исходнике (№5 не исправляем)
         try:
-            writer.sheets["Государственные"].autofit()
-            writer.sheets["Корпоративные"].autofit()
+            for sheet in writer.sheets.values():
+                sheet.autofit()
         except Exception:
             # xlsxwriter обычно не имеет autofit(); оставим молча — согласно исключению №5
             pass
 
+# ---- Parquet / Arrow IPC / CSV: те же два листа отдельными файлами, с типами вместо «Н/д» ----
+# <имя>_government.<ext> и <имя>_corporate.<ext>. «Н/д» и «Не оценен» в риске — пустые значения,
+# рейтинги и сектор в Parquet/Arrow — строки со словарём. pyarrow нужен только для parquet/arrow.
+OUTPUT_FORMATS = ("xlsx", "parquet", "arrow", "csv")
+OUTPUT_PARTS = {"government": "Государственные", "corporate": "Корпоративные"}
+
+EXPORT_TYPES = {
+    "Имя": "string", "Тикер": "string",
+    "Цена_плюс_НКД": "float64", "Купон": "float64", "Годовая_доходность": "float64",
+    "Доходность_к_погашению": "float64", "Купонов_в_год": "int32", "Лет_до_погашения": "float64",
+    "Дюрация": "float64", "Эффективная_доходность": "float64", "Дюрация_Маколея": "float64",
+    "Модифицированная_дюрация": "float64", "Выпуклость": "float64",
+    "Рейтинг_АКРА": "dictionary", "Рейтинг_НРА": "dictionary", "Рейтинг_НКР": "dictionary",
+    "Риск_Тинькофф": "int8", "Сектор": "dictionary",
+}
+
+def export_schema():
+    import pyarrow as pa
+    types = {"string": pa.string(), "float64": pa.float64(), "int32": pa.int32(), "int8": pa.int8(),
+             "dictionary": pa.dictionary(pa.int32(), pa.string())}
+    return pa.schema([(name, types[EXPORT_TYPES[name]]) for name in ROW_COLUMNS])
+
+def typed_columns(columns: dict) -> dict:
+    """Столбцы итоговой таблицы с типами из EXPORT_TYPES: числа — float64 с NaN вместо «Н/д», риск — int или None."""
+    typed = {}
+    for name in ROW_COLUMNS:
+        values = columns[name]
+        kind = EXPORT_TYPES[name]
+        if kind == "float64":
+            values = _float_or_nan(values)
+        elif kind == "int32":
+            values = np.asarray(values, dtype=np.int32)
+        elif kind == "int8":
+            values = np.array([v if isinstance(v, int) else None for v in values], dtype=object)
+        else:
+            values = np.array([v if v is None or isinstance(v, str) else str(v) for v in values], dtype=object)
+        typed[name] = values
+    return typed
+
+def output_paths(filename: str, fmt: str) -> dict:
+    stem = os.path.splitext(filename)[0]
+    return {part: f"{stem}_{part}.{fmt}" for part in (*OUTPUT_PARTS, "scenarios")}
+
+def _float_or_nan(values):
+    values = np.asarray(values, dtype=object)
+    return np.where(values == "Н/д", np.nan, values).astype(np.float64)
+
+def _write_columnar_file(columns: dict, names, schema, path: str, fmt: str):
+    tmp_path = path + ".tmp"
+    if fmt == "csv":
+        pd.DataFrame(columns, columns=names).to_csv(tmp_path, index=False, encoding="utf-8")
+    else:
+        import pyarrow as pa
+        table = pa.table([pa.array(columns[field.name], type=field.type, from_pandas=True) for field in schema],
+                         schema=schema)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, tmp_path)
+        else:
+            with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def write_columnar(government: dict, corporate: dict, filename: str, fmt: str):
+    """Оба листа в формате fmt (parquet, arrow, csv): сортировка и --clear — как в write_excel.
+    Со сценариями ставок — ещё <имя>_scenarios.<ext>, как лист «Сценарии»."""
+    if NOT_WRITE_WITHOUT_RATING:
+        corporate = take_rows(corporate, has_any_rating(corporate))
+    schema = None
+    if fmt != "csv":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError(f"write_columnar::Для --format {fmt} нужен pyarrow: python -m pip install pyarrow")
+        schema = export_schema()
+    paths = output_paths(filename, fmt)
+
+    for part, columns in zip(OUTPUT_PARTS, (government, corporate)):
+        columns = typed_columns(columns)
+        order = np.argsort(-columns["Годовая_доходность"], kind="stable")
+        _write_columnar_file(take_rows(columns, order), ROW_COLUMNS, schema, paths[part], fmt)
+
+    scenarios = scenario_names(government)
+    if scenarios:
+        both = {name: np.concatenate([np.asarray(government[name], dtype=object),
+                                      np.asarray(corporate[name], dtype=object)]) for name in government}
+        columns = typed_columns(both)
+        columns.update({name: _float_or_nan(both[name]) for name in scenarios})
+        order = np.argsort(-columns["Годовая_доходность"], kind="stable")
+        names = [*SCENARIO_BASE_COLUMNS, *scenarios]
+        if schema is not None:
+            schema = pa.schema([*(schema.field(name) for name in SCENARIO_BASE_COLUMNS),
+                                *(pa.field(name, pa.float64()) for name in scenarios)])
+        _write_columnar_file(take_rows({name: columns[name] for name in names}, order), names, schema,
+                             paths["scenarios"], fmt)
+
+def write_output(columns: dict, filename: str, fmt: str = "xlsx"):
+    """Итоговая таблица, разделённая на государственные и корпоративные, в Excel или в файлы формата fmt."""
+    # оставим логику «government» как отдельный лист; муниципальные можно считать к государственным
+    government = np.isin(columns["Сектор"], ["Государственный", "Муниципальный"])
+    if fmt == "xlsx":
+        write_excel(take_rows(columns, government), take_rows(columns, ~government), filename)
+    else:
+        write_columnar(take_rows(columns, government), take_rows(columns, ~government), filename, fmt)
+
+# ---- История запусков: HISTORY_DIR/date=ГГГГ-ММ-ДД/<время>-<pid>.arrow ----
+# Файлы только добавляются: на каждый запуск новый Arrow IPC файл без сжатия со строками итоговой
+# таблицы (типы как в export_schema) и исходными ценой, НКД и номиналом. Без сжатия — чтобы
+# read_history мог отображать файлы в память и читать только нужные столбцы нужных дней.
+def history_schema():
+    import pyarrow as pa
+    raw = [("run_at", pa.timestamp("us", tz="UTC")), ("figi", pa.string()), ("isin", pa.string()),
+           ("quote", pa.float64()), ("aci", pa.float64()), ("nominal", pa.float64())]
+    return pa.schema([*raw, *export_schema()])
+
+def history_table(table: BondTable, columns: dict, rows, run_at: datetime):
+    """Строки итоговой таблицы columns (облигации table с номерами rows) в схеме history_schema."""
+    import pyarrow as pa
+    schema = history_schema()
+    typed = typed_columns(columns)
+    rows = np.asarray(rows, dtype=np.int64)
+    has_price = np.asarray(table.has_price)[rows]
+    typed.update({
+        "run_at": np.full(len(rows), to_us(run_at), dtype=np.int64),
+        "figi": np.array(table.figi, dtype=object)[rows],
+        "isin": np.array(table.isin, dtype=object)[rows],
+        # без цены котировки нет вовсе, а не 0
+        "quote": np.where(has_price, np.asarray(table.quote, dtype=np.float64)[rows], np.nan),
+        "aci": np.asarray(table.aci, dtype=np.float64)[rows],
+        "nominal": np.asarray(table.nominal, dtype=np.float64)[rows],
+    })
+    return pa.table([pa.array(typed[field.name], type=field.type, from_pandas=True) for field in schema],
+                    schema=schema)
+
+def write_history(batch, run_at: datetime, directory: str) -> str:
+    """Кладёт таблицу одного запуска новым файлом в раздел его даты; возвращает путь."""
+    import pyarrow as pa
+    local = run_at.astimezone()
+    partition = os.path.join(directory, f"date={local:%Y-%m-%d}")
+    os.makedirs(partition, exist_ok=True)
+    name = f"{local:%H%M%S%f}-{os.getpid()}"
+    path, n = os.path.join(partition, name + ".arrow"), 0
+    # уже записанное не перезаписываем никогда
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(partition, f"{name}-{n}.arrow")
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, batch.schema) as writer:
+        writer.write_table(batch)
+    os.replace(tmp_path, path)
+    return path
+
+def append_history(table: BondTable, columns: dict, rows):
+    """Дописывает текущий запуск в HISTORY_DIR; история не обязательна, поэтому ошибки только в лог."""
+    if not HISTORY_DIR:
+        return
+    try:
+        path = write_history(history_table(table, columns, rows, UTCNOW), UTCNOW, HISTORY_DIR)
+        logging.info("History snapshot written to %s", path)
+    except ImportError:
+        logging.warning("pyarrow is not installed, history is not written")
+    except Exception as e:
+        logging.warning("Cannot write history to %s: %s", HISTORY_DIR, e)
+
+def _history_day(value):
+    """date из date, datetime или строки "ГГГГ-ММ-ДД"; None остаётся None."""
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value.date() if isinstance(value, datetime) else value
+
+def history_files(start=None, end=None, directory=None) -> list:
+    """Файлы истории за даты [start, end] (включительно, date или "ГГГГ-ММ-ДД"; None — без границы) по порядку."""
+    directory = directory or HISTORY_DIR
+    start, end = _history_day(start), _history_day(end)
+    files = []
+    try:
+        partitions = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return files
+    for partition in partitions:
+        if not partition.startswith("date="):
+            continue
+        try:
+            day = _history_day(partition[len("date="):])
+        except ValueError:
+            continue
+        if (start and day < start) or (end and day > end):
+            continue
+        folder = os.path.join(directory, partition)
+        files.extend(os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".arrow"))
+    return files
+
+def read_history(start=None, end=None, columns=None, directory=None):
+    """История за даты [start, end] одной pyarrow.Table.
+
+    Файлы отображаются в память, а не читаются: в RAM попадают только страницы выбранных столбцов
+    columns (None — все), так что год ежедневных снимков можно разбирать по паре столбцов.
+    """
+    import pyarrow as pa
+    tables = []
+    for path in history_files(start, end, directory):
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        if columns is not None:
+            # столбцов, которых в старых файлах ещё не было, там нет — добавятся пустыми при склейке
+            table = table.select([name for name in columns if name in table.schema.names])
+        tables.append(table)
+    if not tables:
+        schema = history_schema()
+        if columns is not None:
+            schema = pa.schema([schema.field(name) for name in columns])
+        return schema.empty_table()
+    result = pa.concat_tables(tables, promote_options="default")
+    return result.select(list(columns)) if columns is not None else result
+
 def open_excel(filename: str):
+    # Excel (и реестр для поиска пути к нему) есть только на Windows
+    if sys.platform != "win32":
+        logging.info("Not on Windows, open %s manually", filename)
+        return
+    import winreg
+    from subprocess import Popen
+
     # старый поиск пути к Excel через реестр, как было
     try:
         handle = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
@@ -470,9 +2297,388 @@ def open_excel(filename: str):
     except Exception as ex:
         raise ValueError(f"open_output_table::Файл {filename} готов, но excel.exe не запускается: {ex}")
 
+# ---- Потоковый режим: цены из MarketDataStream, пересчёт только изменившихся строк ----
+class LiveTable:
+    """Посчитанные столбцы в памяти. Цены приходят по одной, при публикации пересчитываются только
+    строки облигаций, по которым с прошлого раза были сделки."""
+
+    def __init__(self, table: BondTable):
+        self.table = table
+        self.rows = np.flatnonzero(~table.failed)
+        # номер облигации -> номер строки в columns
+        self.row_of = np.full(len(table), -1, dtype=np.int64)
+        self.row_of[self.rows] = np.arange(len(self.rows))
+        self.position = {table.figi[i]: i for i in self.rows}
+        self.columns = compute_columns(table)
+        self.dirty = set()
+
+    def update_price(self, figi, price):
+        i = self.position.get(figi)
+        if i is None:
+            return
+        self.table.quote[i] = price.units + (price.nano / DIV)
+        self.table.has_price[i] = True
+        self.dirty.add(i)
+
+    def new_day(self, bonds):
+        """Сроки до погашения, НКД и прошедшие купоны меняются раз в день — тогда пересчитываются все строки."""
+        self.table.refresh_static(bonds)
+        self.table.drop_paid_coupons(to_us(UTCNOW))
+        self.dirty.update(self.rows.tolist())
+
+    def refresh(self) -> bool:
+        """Пересчитывает изменившиеся строки; False — пересчитывать было нечего."""
+        if not self.dirty:
+            return False
+        changed = np.array(sorted(self.dirty), dtype=np.int64)
+        self.dirty.clear()
+        fresh = compute_columns(self.table, changed)
+        positions = self.row_of[changed]
+        for name, values in fresh.items():
+            self.columns[name][positions] = values
+        return True
+
+def publish_columns(columns: dict):
+    """Текущая таблица — в Excel (или OUTPUT_FORMAT) и, если задан STREAM_JSON, в JSON (через временный файл)."""
+    try:
+        write_output(columns, EXCEL_TABLE_NAME, OUTPUT_FORMAT)
+    except PermissionError as e:
+        # файл открыт в Excel — пропустим эту публикацию, следующая получится после закрытия
+        logging.warning("Cannot write %s: %s", EXCEL_TABLE_NAME, e)
+
+    if STREAM_JSON:
+        names = list(columns)
+        rows = [dict(zip(names, values)) for values in zip(*(columns[name].tolist() for name in names))]
+        tmp_path = STREAM_JSON + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": datetime.now(timezone.utc).isoformat(), "rows": rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, STREAM_JSON)
+
+def _stream_last_prices(figis, updates: queue.Queue, stop: threading.Event):
+    """Один MarketDataStream на пачку figi: последние цены складываются в updates, при обрыве — переподключение.
+
+    Переподключение всегда идёт с бэкоффом, в том числе когда сервер просто закрыл поток: иначе
+    поток, который сразу же закрывается, превратился бы в цикл переподключений. Счётчик попыток
+    сбрасывается, только когда по новому подключению пришёл хотя бы один ответ.
+    """
+    from tinkoff.invest import LastPriceInstrument
+    attempt, delay = 0, 0.5
+    while not stop.is_set():
+        stream = None
+        try:
+            stream = get_client().create_market_data_stream()
+            stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in figis])
+            for response in stream:
+                attempt, delay = 0, 0.5
+                if response.last_price:
+                    updates.put((response.last_price.figi, response.last_price.price))
+                if stop.is_set():
+                    break
+        except Exception as e:
+            logging.warning("Market data stream error: %s", e)
+            pause, delay = _smart_retry_pause(e, attempt, delay)
+        else:
+            if stop.is_set():
+                break
+            logging.warning("Market data stream closed by server, reconnecting")
+            pause = 0.5 * (2 ** attempt)
+        finally:
+            if stream is not None:
+                stream.stop()
+        attempt += 1
+        stop.wait(min(pause, 60))
+
+def stream_bonds(table: BondTable):
+    """Держит таблицу в памяти и раз в STREAM_PUBLISH_SECONDS публикует её, если цены менялись. До Ctrl+C.
+
+    Метрики пишутся после каждой публикации, а на POSIX ещё и по сигналу SIGUSR1 (в течение секунды).
+    """
+    import signal
+    dump_requested = threading.Event()
+    if hasattr(signal, "SIGUSR1"):
+        # сам обработчик ничего не пишет: он может прервать главный поток внутри блокировки METRICS
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump_requested.set())
+
+    live = LiveTable(table)
+    append_history(table, live.columns, live.rows)
+    publish_columns(live.columns)
+    dump_metrics()
+
+    figis = [table.figi[i] for i in live.rows]
+    updates = queue.Queue()
+    stop = threading.Event()
+    for n in range(0, len(figis), STREAM_SUBSCRIPTIONS):
+        threading.Thread(target=_stream_last_prices, args=(figis[n:n + STREAM_SUBSCRIPTIONS], updates, stop),
+                         name=f"stream-{n // STREAM_SUBSCRIPTIONS}", daemon=True).start()
+
+    next_publish = time.monotonic() + STREAM_PUBLISH_SECONDS
+    try:
+        while True:
+            try:
+                figi, price = updates.get(timeout=min(1.0, max(0.0, next_publish - time.monotonic())))
+                live.update_price(figi, price)
+            except queue.Empty:
+                pass
+            if dump_requested.is_set():
+                dump_requested.clear()
+                dump_metrics()
+            if time.monotonic() >= next_publish:
+                # в течение дня все строки считаются от одного момента, как в обычном запуске
+                if datetime.now(timezone.utc).date() != UTCNOW.date():
+                    refresh_clock()
+                    live.new_day(call_with_retry(lambda: get_client().instruments.bonds(), method="bonds").instruments)
+                if live.refresh():
+                    publish_columns(live.columns)
+                    dump_metrics()
+                next_publish = time.monotonic() + STREAM_PUBLISH_SECONDS
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+
+# ---- Сервер (--serve): одна загрузка на всех, таблица из памяти по HTTP ----
+# Фоновый поток раз в SERVE_REFRESH_SECONDS делает полный сбор, а между ними раз в SERVE_REPRICE_SECONDS —
+# быстрый пересчёт по снимку. Готовая таблица подменяется целиком, запросы читают последнюю.
+#   GET /bonds?part=corporate&Сектор=Финансы,ИТ&Годовая_доходность.min=12&sort=-Годовая_доходность
+#              &columns=Имя,Тикер&limit=50&offset=0&clear=1&format=json|csv
+#   GET /status — время и вид последнего обновления, ошибка, если была; GET /metrics — метрики Prometheus
+# Ответы /bonds с ETag (номер версии таблицы + запрос): If-None-Match с тем же значением — 304 без тела.
+ServedTable = namedtuple("ServedTable", "columns typed version updated_at source")
+
+class BondServer:
+    def __init__(self):
+        self.table = None  # ServedTable
+        self.last_error = None
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = {}  # ETag -> (тип содержимого, тело) для текущей версии
+
+    def publish(self, table: BondTable, source: str):
+        columns = compute_columns(table)
+        append_history(table, columns, np.flatnonzero(~table.failed))
+        typed = typed_columns(columns)
+        with self._lock:
+            version = self.table.version + 1 if self.table else 1
+            self.table = ServedTable(columns, typed, version, datetime.now(timezone.utc).isoformat(), source)
+            self._responses.clear()
+        logging.info("Serving version %d (%s): %d rows", version, source, len(columns["Имя"]))
+
+    def _update(self, source: str, load):
+        try:
+            self.publish(load(), source)
+            self.last_error = None
+        except Exception as e:
+            # отдаём прежнюю таблицу, пока следующее обновление не получится
+            logging.warning("Server %s failed: %s", source, e)
+            self.last_error = f"{source}: {e}"
+        try:
+            dump_metrics()
+        except Exception as e:
+            logging.warning("Cannot write metrics: %s", e)
+
+    def refresh_loop(self, engine: str, reprice_first: bool):
+        def collect():
+            table = collect_bonds(engine)
+            table.save(SNAPSHOT_FILE)
+            return screen_table(table)
+
+        now = time.monotonic()
+        next_full = now + SERVE_REFRESH_SECONDS if reprice_first else now
+        next_reprice = now if reprice_first else now + SERVE_REPRICE_SECONDS
+        while not self.stop.is_set():
+            if time.monotonic() >= next_full:
+                self._update("collect", collect)
+                next_full = time.monotonic() + SERVE_REFRESH_SECONDS
+                next_reprice = time.monotonic() + SERVE_REPRICE_SECONDS
+            elif SERVE_REPRICE_SECONDS and time.monotonic() >= next_reprice:
+                self._update("reprice", reprice_bonds)
+                next_reprice = time.monotonic() + SERVE_REPRICE_SECONDS
+            wake = min(next_full, next_reprice if SERVE_REPRICE_SECONDS else next_full)
+            self.stop.wait(max(0.0, wake - time.monotonic()))
+
+    def status(self) -> dict:
+        served = self.table
+        return {
+            "version": served.version if served else None,
+            "updated_at": served.updated_at if served else None,
+            "source": served.source if served else None,
+            "rows": len(served.columns["Имя"]) if served else 0,
+            "last_error": self.last_error,
+        }
+
+    def respond(self, query: str, if_none_match=None):
+        """(код, заголовки, тело) ответа /bonds на строку запроса query."""
+        from hashlib import sha1
+        from urllib.parse import parse_qsl
+        served = self.table
+        if served is None:
+            return 503, {"Retry-After": "30"}, "Таблица ещё загружается".encode("utf-8")
+
+        params = parse_qsl(query, keep_blank_values=True)
+        etag = '"%d-%s"' % (served.version, sha1(repr(sorted(params)).encode("utf-8")).hexdigest()[:16])
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Bonds-Updated-At": served.updated_at}
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return 304, headers, b""
+
+        cached = self._responses.get(etag)
+        if cached is None:
+            try:
+                cached = render_query(served, dict(params))
+            except ValueError as e:
+                return 400, {}, str(e).encode("utf-8")
+            with self._lock:
+                if self.table is served:
+                    self._responses[etag] = cached
+        content_type, body = cached
+        return 200, {**headers, "Content-Type": content_type}, body
+
+def _as_numbers(values: "np.ndarray"):
+    """Столбец как float64 с NaN вместо пустых значений или None, если в нём не числа."""
+    if values.dtype.kind in "fiu":
+        return values.astype(np.float64)
+    if any(isinstance(v, str) for v in values):
+        return None
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+def _sort_keys(values: "np.ndarray", descending: bool) -> list:
+    """Ключи для np.lexsort: пустые значения всегда в конце, остальное по возрастанию или убыванию."""
+    numbers = _as_numbers(values)
+    if numbers is not None:
+        missing = np.isnan(numbers)
+        key = np.where(missing, 0.0, numbers)
+    else:
+        missing = np.array([v is None for v in values], dtype=bool)
+        _, key = np.unique(np.array(["" if v is None else v for v in values], dtype=object), return_inverse=True)
+    return [-key if descending else key, missing]
+
+def render_query(served: ServedTable, params: dict):
+    """Фильтр, сортировка, столбцы и формат ответа /bonds по параметрам запроса."""
+    typed, columns = served.typed, served.columns
+    mask = np.ones(len(columns["Имя"]), dtype=bool)
+
+    government = np.isin(columns["Сектор"], ["Государственный", "Муниципальный"])
+    part = params.pop("part", "")
+    if part not in ("", *OUTPUT_PARTS):
+        raise ValueError(f"part: ожидается {' или '.join(OUTPUT_PARTS)}")
+    if part:
+        mask &= government if part == "government" else ~government
+    if params.pop("clear", "") not in ("", "0"):
+        # как -c: без рейтингов убираются только корпоративные
+        mask &= government | has_any_rating(columns)
+
+    names = params.pop("columns", "")
+    names = [name for name in names.split(",") if name] or list(ROW_COLUMNS)
+    sort = [name for name in params.pop("sort", "").split(",") if name]
+    fmt = params.pop("format", "json")
+    try:
+        offset = int(params.pop("offset", 0))
+        limit = params.pop("limit", "")
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise ValueError("offset и limit должны быть целыми числами")
+    # отрицательные значения срез Python понял бы как отсчёт с конца
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset и limit не могут быть отрицательными")
+    if fmt not in ("json", "csv"):
+        raise ValueError("format: json или csv")
+
+    for key, value in params.items():
+        name, _, bound = key.partition(".")
+        if name not in typed or bound not in ("", "min", "max"):
+            raise ValueError(f"Неизвестный параметр: {key}")
+        if bound:
+            values = _as_numbers(typed[name])
+            if values is None:
+                raise ValueError(f"{key}: у столбца {name} нет числовых значений")
+            try:
+                limit_value = float(value)
+            except ValueError:
+                raise ValueError(f"{key}: ожидается число")
+            with np.errstate(invalid="ignore"):
+                mask &= values >= limit_value if bound == "min" else values <= limit_value
+        else:
+            wanted = value.split(",")
+            mask &= np.array([str(v) in wanted for v in columns[name]], dtype=bool)
+    for name in names + [name.lstrip("-") for name in sort]:
+        if name not in typed:
+            raise ValueError(f"Неизвестный столбец: {name}")
+
+    rows = np.flatnonzero(mask)
+    if sort:
+        keys = []
+        # np.lexsort: последний ключ — главный
+        for name in reversed(sort):
+            keys.extend(_sort_keys(typed[name.lstrip("-")][rows], name.startswith("-")))
+        rows = rows[np.lexsort(keys)]
+    total = len(rows)
+    rows = rows[offset:offset + limit if limit is not None else None]
+
+    values = [columns[name][rows].tolist() for name in names]
+    if fmt == "csv":
+        import csv
+        import io
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(names)
+        writer.writerows(zip(*values))
+        return "text/csv; charset=utf-8", out.getvalue().encode("utf-8")
+    body = {"version": served.version, "updated_at": served.updated_at, "total": total,
+            "rows": [dict(zip(names, row)) for row in zip(*values)]}
+    return "application/json; charset=utf-8", json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+def serve_bonds(engine: str, reprice_first: bool):
+    """--serve: таблица в памяти с фоновым обновлением, отдаётся по HTTP на SERVE_ADDRESS. До Ctrl+C."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    bonds = BondServer()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path in ("/", "/bonds"):
+                status, headers, body = bonds.respond(url.query, self.headers.get("If-None-Match"))
+            elif url.path == "/status":
+                status, headers = 200, {"Content-Type": "application/json; charset=utf-8"}
+                body = json.dumps(bonds.status(), ensure_ascii=False).encode("utf-8")
+            elif url.path == "/metrics":
+                status, headers = 200, {"Content-Type": "text/plain; version=0.0.4"}
+                body = METRICS.prometheus().encode("utf-8")
+            else:
+                status, headers, body = 404, {}, b""
+            headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("%s %s", self.address_string(), format % args)
+
+    host, _, port = SERVE_ADDRESS.rpartition(":")
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=bonds.refresh_loop, args=(engine, reprice_first), name="refresh", daemon=True).start()
+    print(f"Таблица облигаций: http://{SERVE_ADDRESS}/bonds (Ctrl+C — остановка)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bonds.stop.set()
+        server.server_close()
+
 # ---- Конфиг и CLI (№13) ----
 def parse_config():
     global TOKEN, API_DELAY, EXCEL_TABLE_NAME, FOR_QUAL_INVESTOR, AMORTIZATION, FLOATING_COUPON
+    global PIPELINE_QUEUE_SIZE, PIPELINE_WORKERS, RATE_LIMITS, ASYNC_CONCURRENCY, PARSE_WORKERS, SCREEN, SCENARIOS
+    global TINKOFF_MIN_RATE, TINKOFF_MAX_RATE, TINKOFF_RAMP
+    global CACHE_DB, COUPON_CACHE_TTL_DAYS, ITN_CACHE_TTL_DAYS, ITN_NEGATIVE_TTL_DAYS
+    global HTTP_POOL_SIZE, HTTP_TIMEOUTS, SNAPSHOT_FILE, HISTORY_DIR, JOURNAL_FILE
+    global STREAM_PUBLISH_SECONDS, STREAM_JSON, STREAM_SUBSCRIPTIONS, METRICS_JSON, METRICS_PROM
+    global SERVE_ADDRESS, SERVE_REFRESH_SECONDS, SERVE_REPRICE_SECONDS
     try:
         with open('config.json', 'r', encoding='utf-8') as f:
             cfg = json.load(f)
@@ -484,6 +2690,33 @@ def parse_config():
         FOR_QUAL_INVESTOR = cfg.get("FOR_QUAL_INVESTOR", None)
         AMORTIZATION = cfg.get("AMORTIZATION", False)
         FLOATING_COUPON = cfg.get("FLOATING_COUPON", False)
+        PIPELINE_QUEUE_SIZE = cfg.get("PIPELINE_QUEUE_SIZE", PIPELINE_QUEUE_SIZE)
+        PIPELINE_WORKERS = {**PIPELINE_WORKERS, **cfg.get("PIPELINE_WORKERS", {})}
+        RATE_LIMITS = {**RATE_LIMITS, **cfg.get("RATE_LIMITS", {})}
+        SCREEN = {**SCREEN, **cfg.get("SCREEN", {})}
+        SCENARIOS = cfg.get("SCENARIOS", SCENARIOS)
+        ASYNC_CONCURRENCY = cfg.get("ASYNC_CONCURRENCY", ASYNC_CONCURRENCY)
+        PARSE_WORKERS = cfg.get("PARSE_WORKERS", PARSE_WORKERS)
+        TINKOFF_MIN_RATE = cfg.get("TINKOFF_MIN_RATE", TINKOFF_MIN_RATE)
+        TINKOFF_MAX_RATE = cfg.get("TINKOFF_MAX_RATE", TINKOFF_MAX_RATE)
+        TINKOFF_RAMP = cfg.get("TINKOFF_RAMP", TINKOFF_RAMP)
+        CACHE_DB = cfg.get("CACHE_DB", CACHE_DB)
+        COUPON_CACHE_TTL_DAYS = cfg.get("COUPON_CACHE_TTL_DAYS", COUPON_CACHE_TTL_DAYS)
+        ITN_CACHE_TTL_DAYS = cfg.get("ITN_CACHE_TTL_DAYS", ITN_CACHE_TTL_DAYS)
+        ITN_NEGATIVE_TTL_DAYS = cfg.get("ITN_NEGATIVE_TTL_DAYS", ITN_NEGATIVE_TTL_DAYS)
+        HTTP_POOL_SIZE = cfg.get("HTTP_POOL_SIZE", HTTP_POOL_SIZE)
+        HTTP_TIMEOUTS = {**HTTP_TIMEOUTS, **cfg.get("HTTP_TIMEOUTS", {})}
+        SNAPSHOT_FILE = cfg.get("SNAPSHOT_FILE", SNAPSHOT_FILE)
+        JOURNAL_FILE = cfg.get("JOURNAL_FILE", JOURNAL_FILE)
+        HISTORY_DIR = cfg.get("HISTORY_DIR", HISTORY_DIR)
+        STREAM_PUBLISH_SECONDS = cfg.get("STREAM_PUBLISH_SECONDS", STREAM_PUBLISH_SECONDS)
+        STREAM_JSON = cfg.get("STREAM_JSON", STREAM_JSON)
+        STREAM_SUBSCRIPTIONS = cfg.get("STREAM_SUBSCRIPTIONS", STREAM_SUBSCRIPTIONS)
+        METRICS_JSON = cfg.get("METRICS_JSON", METRICS_JSON)
+        METRICS_PROM = cfg.get("METRICS_PROM", METRICS_PROM)
+        SERVE_ADDRESS = cfg.get("SERVE_ADDRESS", SERVE_ADDRESS)
+        SERVE_REFRESH_SECONDS = cfg.get("SERVE_REFRESH_SECONDS", SERVE_REFRESH_SECONDS)
+        SERVE_REPRICE_SECONDS = cfg.get("SERVE_REPRICE_SECONDS", SERVE_REPRICE_SECONDS)
     except Exception as e:
         raise ValueError("parse_parameters_from_config::" + str(e))
 
@@ -494,41 +2727,109 @@ def main():
         help="Не выводить в листе 'Корпоративные' компании без всех трёх рейтингов (АКРА, НРА, НКР)"
     )
     parser.add_argument("--out", default="bonds.xlsx", help="Имя выходного Excel файла (переопределяет config.json)")
+    parser.add_argument(
+        "--format", choices=OUTPUT_FORMATS,
+        help="Формат вывода: xlsx (по умолчанию, или по расширению --out), parquet, arrow (Arrow IPC), csv. "
+             "Для parquet/arrow/csv листы пишутся в <имя>_government.<формат> и <имя>_corporate.<формат>"
+    )
+    parser.add_argument(
+        "--engine", choices=[*ENGINES, "async"], default="serial",
+        help="Способ сбора: serial — по одной облигации, "
+             "pipeline — параллельные стадии в нескольких потоках, "
+             "async — до ASYNC_CONCURRENCY запросов купонов одновременно через асинхронный клиент"
+    )
+    parser.add_argument("--min-yield", type=float, help="Отсев: годовая доходность не ниже, %% (SCREEN.min_yield)")
+    parser.add_argument("--max-years", type=float, help="Отсев: лет до погашения не больше (SCREEN.max_years)")
+    parser.add_argument("--max-duration", type=float, help="Отсев: дюрация не больше, лет (SCREEN.max_duration)")
+    parser.add_argument("--top", type=int, help="Отсев: оставить столько лучших по годовой доходности (SCREEN.top_k)")
+    parser.add_argument(
+        "--no-cache", action="store_true", default=False,
+        help="Не использовать локальный кэш (CACHE_DB): всё запросить заново"
+    )
+    parser.add_argument(
+        "--reprice", action="store_true", default=False,
+        help="Быстрый пересчёт: купоны, рейтинги и сектора из снимка прошлого полного запуска (SNAPSHOT_FILE), "
+             "заново запрашиваются только цены и НКД"
+    )
+    parser.add_argument(
+        "--stream", action="store_true", default=False,
+        help="После загрузки не завершаться: получать цены из потока Тинькофф и раз в STREAM_PUBLISH_SECONDS "
+             "переписывать Excel (и STREAM_JSON) с пересчётом только изменившихся строк. Остановка — Ctrl+C"
+    )
+    parser.add_argument(
+        "--serve", action="store_true", default=False,
+        help="Режим сервера: сбор раз в SERVE_REFRESH_SECONDS (с --reprice — сначала пересчёт по снимку), "
+             "между ними пересчёт цен раз в SERVE_REPRICE_SECONDS; таблица отдаётся по HTTP на SERVE_ADDRESS"
+    )
+    parser.add_argument(
+        "--scenarios", action="store_true", default=False,
+        help="Переоценить облигации под сценариями ставок SCENARIOS: изменение цены + НКД в %% "
+             "на отдельном листе «Сценарии» (для parquet/arrow/csv — в <имя>_scenarios.<формат>)"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", default=False,
+        help="Продолжить прерванный сбор по журналу JOURNAL_FILE: облигации, уже записанные в журнал, "
+             "заново не запрашиваются"
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
     parser.add_argument("--log", default="WARNING", help="Уровень логирования: DEBUG|INFO|WARNING|ERROR")
     args = parser.parse_args()
 
     logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO),
                         format="%(asctime)s %(levelname)s: %(message)s")
 
-    global NOT_WRITE_WITHOUT_RATING, EXCEL_TABLE_NAME
+    global NOT_WRITE_WITHOUT_RATING, EXCEL_TABLE_NAME, USE_CACHE, OUTPUT_FORMAT, WITH_SCENARIOS
     NOT_WRITE_WITHOUT_RATING = args.clear
+    WITH_SCENARIOS = args.scenarios
+    USE_CACHE = not args.no_cache
 
     try:
         parse_config()
         if args.out:
             EXCEL_TABLE_NAME = args.out
-
-        client = get_client()  # открыть соединение один раз (№1)
-
-        # загрузка и разделение на гос/корп
-        all_rows = collect_bonds()
-        gov_rows = []
-        corp_rows = []
-        
-        for r in all_rows:
-            if r.Сектор == "Государственный" or r.Сектор == "Муниципальный":
-                # оставим логику «government» как отдельный лист; муниципальные можно считать к государственным
-                gov_rows.append(r)
-            else:
-                corp_rows.append(r)
-
-        write_excel(gov_rows, corp_rows, EXCEL_TABLE_NAME)
-        open_excel(EXCEL_TABLE_NAME)
+        for key, value in (("min_yield", args.min_yield), ("max_years", args.max_years),
+                           ("max_duration", args.max_duration), ("top_k", args.top)):
+            if value is not None:
+                SCREEN[key] = value
+        extension = os.path.splitext(EXCEL_TABLE_NAME)[1].lstrip(".").lower()
+        OUTPUT_FORMAT = args.format or (extension if extension in OUTPUT_FORMATS else "xlsx")
+
+        if args.serve:
+            serve_bonds(args.engine, args.reprice)
+            return
+
+        # загрузка (или пересчёт по снимку) и разделение на гос/корп
+        if args.reprice:
+            table = reprice_bonds()
+        else:
+            table = collect_bonds(args.engine, resume=args.resume)
+            # в снимок — все облигации, чтобы --reprice и --serve видели и отсеянные
+            table.save(SNAPSHOT_FILE)
+            table = screen_table(table)
+        if args.stream:
+            stream_bonds(table)
+            return
+        columns = compute_columns(table)
+        append_history(table, columns, np.flatnonzero(~table.failed))
+        write_output(columns, EXCEL_TABLE_NAME, OUTPUT_FORMAT)
+        if OUTPUT_FORMAT == "xlsx":
+            open_excel(EXCEL_TABLE_NAME)
 
     except Exception as ex:
         print(ex)
     finally:
+        try:
+            dump_metrics()
+        except Exception as e:
+            logging.warning("Cannot write metrics: %s", e)
         close_client()
+        close_http_sessions()
+        close_parse_pool()
 
 if __name__ == "__main__":
+    # собранный pyinstaller'ом bondsList.exe: процессы пула разбора (spawn) запускают этот же exe,
+    # и freeze_support() выполняет в них задачу пула вместо main(); без сборки он ничего не делает
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()